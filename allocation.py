@@ -0,0 +1,119 @@
+from array import array
+from collections import deque
+from typing import Deque, Iterable, List, Optional, Set
+
+from tree_graph import (FLAG_ASCENDANCY, FLAG_ASCENDANCY_START, FLAG_JEWEL_SOCKET, FLAG_KEYSTONE, FLAG_MASTERY,
+                        FLAG_MULTIPLE_CHOICE_OPTION, FLAG_NOTABLE, FLAG_ROOT, TreeGraph)
+
+FREE_FLAGS = FLAG_ROOT | FLAG_ASCENDANCY_START | FLAG_MULTIPLE_CHOICE_OPTION
+# allocation changes kept for undo
+HISTORY_LIMIT = 1000
+
+class AllocationTransaction:
+    # a set of nodes to allocate and deallocate that is validated and applied as a whole,
+    # see SkillTreeView.commit_allocation
+    def __init__(self):
+        self.additions: Set[str] = set()
+        self.removals: Set[str] = set()
+
+    def allocate(self, node_ids: Iterable[str]) -> None:
+        for node_id in node_ids:
+            self.removals.discard(node_id)
+            self.additions.add(node_id)
+
+    def deallocate(self, node_ids: Iterable[str]) -> None:
+        for node_id in node_ids:
+            self.additions.discard(node_id)
+            self.removals.add(node_id)
+
+    def __bool__(self) -> bool:
+        return bool(self.additions or self.removals)
+
+class AllocationStats:
+    # allocation counts kept up to date one node at a time, see SkillTreeView.set_allocated.
+    # roots, ascendancy starts and multiple choice options are free and don't count as points
+    def __init__(self, graph: TreeGraph):
+        self.graph = graph
+
+        self.main_points = 0
+        self.ascendancy_points = 0
+        self.notables = 0
+        self.keystones = 0
+        self.masteries = 0
+        self.jewel_sockets = 0
+
+    @property
+    def points(self) -> int:
+        return self.main_points + self.ascendancy_points
+
+    def change(self, index: int, delta: int) -> None:
+        # delta is 1 when the node was allocated and -1 when it was deallocated
+        flags = self.graph.flags[index]
+
+        if not flags & FREE_FLAGS:
+            if flags & FLAG_ASCENDANCY:
+                self.ascendancy_points += delta
+            else:
+                self.main_points += delta
+
+        if flags & FLAG_NOTABLE:
+            self.notables += delta
+        if flags & FLAG_KEYSTONE:
+            self.keystones += delta
+        if flags & FLAG_MASTERY:
+            self.masteries += delta
+        if flags & FLAG_JEWEL_SOCKET:
+            self.jewel_sockets += delta
+
+    def __repr__(self) -> str:
+        return (f"AllocationStats(points={self.points}, main_points={self.main_points}, ascendancy_points={self.ascendancy_points}, "
+                f"notables={self.notables}, keystones={self.keystones}, masteries={self.masteries}, jewel_sockets={self.jewel_sockets})")
+
+class AllocationHistory:
+    # undo and redo over allocation changes. every entry is the sorted indices of the nodes an
+    # operation flipped, so applying it again in either direction just flips them back
+    def __init__(self, limit: int = HISTORY_LIMIT):
+        self.undo_stack: Deque[array] = deque(maxlen=limit)
+        self.redo_stack: List[array] = []
+        self.pending: Set[int] = set()
+        self.recording = True
+
+    def record(self, index: int) -> None:
+        if not self.recording:
+            return
+
+        # a node flipped twice within one operation didn't change
+        if index in self.pending:
+            self.pending.remove(index)
+        else:
+            self.pending.add(index)
+
+    def commit(self) -> None:
+        # ends the current operation, a new change makes the undone ones unreachable
+        if not self.pending:
+            return
+
+        self.undo_stack.append(array('i', sorted(self.pending)))
+        self.redo_stack.clear()
+        self.pending = set()
+
+    def undo(self) -> Optional[array]:
+        if not self.undo_stack:
+            return None
+
+        delta = self.undo_stack.pop()
+        self.redo_stack.append(delta)
+        return delta
+
+    def redo(self) -> Optional[array]:
+        if not self.redo_stack:
+            return None
+
+        delta = self.redo_stack.pop()
+        self.undo_stack.append(delta)
+        return delta
+
+    def clear(self) -> None:
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.pending = set()
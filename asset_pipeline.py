@@ -0,0 +1,301 @@
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import pathlib
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import sprite_cache
+from background import BACKGROUND_CACHE_VERSION, BACKGROUND_SCALES, Placement, build_background_tiles, get_background_placements
+
+SPRITES_DIR = "sprites"
+MANIFEST_PATH = f"{SPRITES_DIR}/manifest.json"
+# directory or url serving the asset files by name, e.g. a local mirror for offline or CI runs
+BASE_URL_ENV = "POE_TREE_ASSET_BASE"
+MAX_DOWNLOADS = 8
+MAX_WORKERS = 4
+CHUNK_SIZE = 1 << 16
+
+CONNECTOR_CACHE_VERSION = 1
+CONNECTOR_STATES = ['Active', 'Intermediate', 'Normal']
+# extra pre-scaled copies of every connector for zoomed out painting
+CONNECTOR_SCALES = (1.0, 0.5, 0.25)
+
+def resolve_url(url: str, base_url: Optional[str]) -> str:
+    if not base_url:
+        return url
+
+    parsed_url = urlparse(url)
+    filename = os.path.basename(parsed_url.path)
+
+    if '://' not in base_url:
+        base_url = pathlib.Path(base_url).resolve().as_uri()
+
+    # file urls can't carry the version query
+    if parsed_url.query and not base_url.startswith('file:'):
+        filename += f"?{parsed_url.query}"
+
+    return f"{base_url.rstrip('/')}/{filename}"
+
+def get_file_hash(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+def download(url: str, target: str) -> None:
+    # downloads into target.part, resuming a previous partial download when the server allows it,
+    # and only moves the file into place once it is complete
+    part = f"{target}.part"
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+
+    request = urllib.request.Request(url)
+    if offset:
+        request.add_header('Range', f"bytes={offset}-")
+
+    with urllib.request.urlopen(request) as response:
+        if offset and getattr(response, 'status', None) != 206:
+            offset = 0
+
+        expected = response.headers.get('Content-Length')
+        with open(part, 'ab' if offset else 'wb') as f:
+            for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                f.write(chunk)
+
+    if expected is not None and os.path.getsize(part) != offset + int(expected):
+        raise IOError(f"Incomplete download of {url}: expected {offset + int(expected)} bytes, got {os.path.getsize(part)}")
+
+    os.replace(part, target)
+
+def split_sheet(sheet_path: str, sprite_coords: Dict[str, dict], cache_path: str) -> int:
+    # runs in a worker process
+    from PIL import Image
+
+    img = Image.open(sheet_path)
+    sprites = []
+
+    for skill in sprite_coords.items():
+        skill_path = skill[0]
+        coords = skill[1]
+
+        sprite = img.crop((coords['x'], coords['y'],
+                            coords['x'] + coords['w'], coords['y'] + coords['h']))
+        sprite = sprite.convert('RGBA')
+
+        sprites.append((skill_path, sprite.width, sprite.height, sprite.tobytes()))
+
+    sprite_cache.write_sprite_cache(cache_path, sprites)
+
+    return len(sprites)
+
+def get_connector_sources() -> List[str]:
+    sources = []
+    for state in CONNECTOR_STATES:
+        sources += [f"Orbit{i}{state}" for i in range(1, 7)]
+        sources.append(f"LineConnector{state}")
+
+    return sources
+
+def get_scaled_name(name: str, scale: float) -> str:
+    return name if scale == 1 else f"{name}@{scale}"
+
+def build_connectors(sources: Dict[str, str], cache_path: str, scales: Tuple[float, ...]) -> int:
+    # runs in a worker process
+    from PIL import Image, ImageOps, ImageEnhance
+
+    def mirror_quadrants(img: Image.Image) -> Image.Image:
+        # orbit art only covers one quadrant of the circle
+        combined = Image.new('RGBA', (img.width * 2, img.height * 2))
+        combined.paste(img, (0, 0))
+        combined.paste(ImageOps.mirror(img), (img.width, 0))
+        combined.paste(ImageOps.flip(img), (0, img.height))
+        combined.paste(ImageOps.mirror(ImageOps.flip(img)), (img.width, img.height))
+        return combined
+
+    connectors = {}
+    for state in CONNECTOR_STATES:
+        for i in range(1, 7):
+            img = Image.open(sources[f"Orbit{i}{state}"]).convert('RGBA')
+            connectors[f"Orbit{i}{state}"] = mirror_quadrants(img)
+
+            if state == 'Normal':
+                img = ImageEnhance.Brightness(img).enhance(3)
+                connectors[f"Orbit{i}HoverPath"] = mirror_quadrants(img)
+
+        img = Image.open(sources[f"LineConnector{state}"]).convert('RGBA')
+        connectors[f"LineConnector{state}"] = img
+        if state == 'Normal':
+            img = ImageEnhance.Brightness(img).enhance(3)
+            connectors["LineConnectorHoverPath"] = img
+
+    images = []
+    for name, img in connectors.items():
+        for scale in scales:
+            scaled = img if scale == 1 else img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+            images.append((get_scaled_name(name, scale), scaled.width, scaled.height, scaled.tobytes()))
+
+    sprite_cache.write_sprite_cache(cache_path, images)
+
+    return len(images)
+
+class AssetPipeline:
+    def __init__(self, base_url: Optional[str] = None, max_downloads: int = MAX_DOWNLOADS, max_workers: int = MAX_WORKERS):
+        self.base_url = base_url if base_url is not None else os.environ.get(BASE_URL_ENV)
+        self.max_downloads = max_downloads
+        self.max_workers = max_workers
+        self.timings = {}
+
+        # file name -> sha256 of the file as it was downloaded. the source publishes no checksums,
+        # so this doesn't verify downloads, only notices files changed on disk since then and
+        # keys caches derived from them. downloads are only checked against Content-Length
+        self.manifest = {}
+        if os.path.exists(MANIFEST_PATH):
+            with open(MANIFEST_PATH) as f:
+                self.manifest = json.load(f)
+
+    def run(self, data: dict) -> Tuple[Dict[str, str], Dict[str, str], str, str]:
+        # returns the sprite cache file of every sheet type, the local file of every asset, the
+        # sprite cache file holding the generated connector images and the background tiles
+        os.makedirs(SPRITES_DIR, exist_ok=True)
+
+        downloads = []
+        splits = []
+        sheet_caches = {}
+        for sheet_type, sheet in data['skillSprites'].items():
+            sprite_sheet = sheet[-1]
+            parsed_url = urlparse(sprite_sheet['filename'])
+            filename = os.path.basename(parsed_url.path)
+            ver = parsed_url.query
+
+            cache_path = sprite_cache.get_sprite_cache_path(sheet_type, filename, ver)
+            sheet_caches[sheet_type] = cache_path
+            if sprite_cache.open_sprite_cache(cache_path) is not None:
+                continue
+
+            sheet_path = f"{SPRITES_DIR}/{filename}_{ver}.png"
+            downloads.append((sprite_sheet['filename'], sheet_path))
+            splits.append((sheet_type, filename, sheet_path, sprite_sheet['coords'], cache_path))
+
+        asset_files = {}
+        for asset_name, asset in data['assets'].items():
+            asset_image = list(asset.values())[-1]
+            asset_path = f"{SPRITES_DIR}/{asset_image.split('/')[-1]}"
+            asset_files[asset_name] = asset_path
+            downloads.append((asset_image, asset_path))
+
+        start = perf_counter()
+        # several sheet types can share one file
+        asyncio.run(self.fetch_all(list(dict((target, url) for url, target in downloads).items())))
+        self.timings['download'] = perf_counter() - start
+
+        connector_sources = {name: asset_files[name] for name in get_connector_sources()}
+        connector_cache = self.get_connector_cache_path(connector_sources)
+        build_connector_cache = sprite_cache.open_sprite_cache(connector_cache) is None
+
+        placements = get_background_placements(data)
+        background_sources = {name: asset_files[name] for name, _, _, _ in placements}
+        background_cache = self.get_background_cache_path(placements, background_sources)
+        background = None
+        if sprite_cache.open_sprite_cache(background_cache) is None:
+            background = (placements, background_sources)
+
+        start = perf_counter()
+        self.process_all(splits, connector_sources if build_connector_cache else None, connector_cache, background, background_cache)
+        self.timings['split'] = perf_counter() - start
+
+        return sheet_caches, asset_files, connector_cache, background_cache
+
+    def get_connector_cache_path(self, sources: Dict[str, str]) -> str:
+        # keyed on the source art and the generated scales, so new art or scales rebuild it
+        sha = hashlib.sha256(f"{CONNECTOR_CACHE_VERSION}{CONNECTOR_SCALES}".encode())
+        for name in sorted(sources):
+            sha.update(self.manifest.get(os.path.basename(sources[name]), name).encode())
+
+        return f"{sprite_cache.SPRITE_CACHE_DIR}/connectors_{sha.hexdigest()[:16]}.bin"
+
+    def get_background_cache_path(self, placements: List[Placement], sources: Dict[str, str]) -> str:
+        # the placements come from the tree data, so a new tree version or new art rebuilds it
+        sha = hashlib.sha256(f"{BACKGROUND_CACHE_VERSION}{BACKGROUND_SCALES}{placements}".encode())
+        for name in sorted(sources):
+            sha.update(self.manifest.get(os.path.basename(sources[name]), name).encode())
+
+        return f"{sprite_cache.SPRITE_CACHE_DIR}/background_{sha.hexdigest()[:16]}.bin"
+
+    async def fetch_all(self, jobs: List[Tuple[str, str]]) -> None:
+        semaphore = asyncio.Semaphore(self.max_downloads)
+
+        async def fetch(target: str, url: str) -> Tuple[str, str]:
+            async with semaphore:
+                return target, await asyncio.to_thread(self.fetch, url, target)
+
+        results = await asyncio.gather(*(fetch(target, url) for target, url in jobs))
+
+        changed = False
+        for target, file_hash in results:
+            name = os.path.basename(target)
+            if self.manifest.get(name) != file_hash:
+                self.manifest[name] = file_hash
+                changed = True
+
+        if changed:
+            with open(f"{MANIFEST_PATH}.tmp", 'w') as f:
+                json.dump(self.manifest, f, indent=1, sort_keys=True)
+            os.replace(f"{MANIFEST_PATH}.tmp", MANIFEST_PATH)
+
+    def fetch(self, url: str, target: str) -> str:
+        name = os.path.basename(target)
+
+        if os.path.exists(target):
+            file_hash = get_file_hash(target)
+            # files without a recorded hash predate the manifest and are trusted once
+            if name not in self.manifest or self.manifest[name] == file_hash:
+                return file_hash
+
+            print(f"{target} changed since it was downloaded, downloading again")
+            os.remove(target)
+
+        download(resolve_url(url, self.base_url), target)
+        return get_file_hash(target)
+
+    def process_all(self, splits: List[Tuple[str, str, str, dict, str]], connector_sources: Optional[Dict[str, str]], connector_cache: str,
+                    background: Optional[Tuple[List[Placement], Dict[str, str]]], background_cache: str) -> None:
+        jobs = len(splits) + (connector_sources is not None) + (background is not None)
+        if jobs == 0:
+            return
+
+        with ProcessPoolExecutor(max_workers=min(self.max_workers, jobs)) as executor:
+            futures = [executor.submit(split_sheet, sheet_path, coords, cache_path) for _, _, sheet_path, coords, cache_path in splits]
+            if connector_sources is not None:
+                futures.append(executor.submit(build_connectors, connector_sources, connector_cache, CONNECTOR_SCALES))
+            if background is not None:
+                futures.append(executor.submit(build_background_tiles, *background, background_cache, BACKGROUND_SCALES))
+
+            for future in futures:
+                future.result()
+
+        if connector_sources is not None:
+            for stale in glob.glob(f"{sprite_cache.SPRITE_CACHE_DIR}/connectors_*.bin"):
+                if stale != connector_cache:
+                    os.remove(stale)
+
+        if background is not None:
+            for stale in glob.glob(f"{sprite_cache.SPRITE_CACHE_DIR}/background_*.bin"):
+                if stale != background_cache:
+                    os.remove(stale)
+
+        # the tree points at a new sheet version, drop cached splits of older ones
+        for sheet_type, filename, _, _, cache_path in splits:
+            for stale in glob.glob(sprite_cache.get_sprite_cache_path(sheet_type, filename, '*')):
+                if stale != cache_path:
+                    os.remove(stale)
+
+    def report(self) -> None:
+        for stage, seconds in self.timings.items():
+            print(f"  {stage}: {seconds:.3f} seconds")
@@ -0,0 +1,109 @@
+import math
+from typing import Dict, List, Optional, Tuple
+
+import sprite_cache
+from geometry import TREE_SCALE
+
+# group and ascendancy backgrounds never change, so they are composited into tiles once per tree
+# version instead of being scene items. kept free of Qt so asset_pipeline workers can build it
+
+BACKGROUND_CACHE_VERSION = 1
+# tile side in pixels at every level, a tile at scale s covers TILE_SIZE / s scene units
+TILE_SIZE = 256
+# pyramid levels, closer in than the largest one the source images are painted directly
+BACKGROUND_SCALES = (0.5, 0.25, 0.125, 0.0625)
+
+# asset name, scene x and y of the image centre, whether the image is mirrored below itself
+Placement = Tuple[str, float, float, bool]
+
+def get_background_placements(data: dict) -> List[Placement]:
+    # in paint order: group backgrounds, then ascendancy backgrounds on top
+    nodes = data['nodes']
+    root_nodes = set(nodes['root']['out'])
+
+    placements = []
+    ascendancy_placements = []
+    for group_data in data['groups'].values():
+        group_nodes = group_data['nodes']
+        x = group_data['x'] * TREE_SCALE
+        y = group_data['y'] * TREE_SCALE
+
+        if 'ascendancyName' in nodes[group_nodes[0]]:
+            if any('isAscendancyStart' in nodes[node] for node in group_nodes):
+                ascendancy_placements.append((f"Classes{nodes[group_nodes[0]]['ascendancyName']}", x, y, False))
+            continue
+
+        if any(node in root_nodes for node in group_nodes):
+            continue
+
+        if 3 in group_data['orbits']:
+            # the art only covers the top half of the circle
+            placements.append(('PSGroupBackground3', x, y, True))
+        elif 2 in group_data['orbits']:
+            placements.append(('PSGroupBackground2', x, y, False))
+        elif 1 in group_data['orbits']:
+            placements.append(('PSGroupBackground1', x, y, False))
+
+    return placements + ascendancy_placements
+
+def get_background_scale(level_of_detail: float) -> Optional[float]:
+    # smallest level that is still at least as large as it will be drawn, None when zoomed in
+    # past the largest one
+    for scale in sorted(BACKGROUND_SCALES):
+        if scale >= level_of_detail:
+            return scale
+
+    return None
+
+def get_tile_name(scale: float, tile_x: int, tile_y: int) -> str:
+    return f"{scale}:{tile_x}:{tile_y}"
+
+def get_visible_tiles(scale: float, left: float, top: float, right: float, bottom: float) -> List[Tuple[int, int]]:
+    # tiles of a level intersecting a scene rect
+    span = TILE_SIZE / scale
+    return [(tile_x, tile_y)
+            for tile_y in range(math.floor(top / span), math.floor(bottom / span) + 1)
+            for tile_x in range(math.floor(left / span), math.floor(right / span) + 1)]
+
+def build_background_tiles(placements: List[Placement], sources: Dict[str, str], cache_path: str, scales: Tuple[float, ...]) -> int:
+    # runs in a worker process
+    from PIL import Image, ImageOps
+
+    images = {}
+    for name, path in sources.items():
+        img = Image.open(path).convert('RGBA')
+        if any(mirrored for placement_name, _, _, mirrored in placements if placement_name == name):
+            combined = Image.new('RGBA', (img.width, img.height * 2))
+            combined.paste(img, (0, 0))
+            combined.paste(ImageOps.flip(img), (0, img.height))
+            img = combined
+        images[name] = img
+
+    entries = []
+    for scale in scales:
+        scaled = {name: img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+                  for name, img in images.items()}
+
+        tiles = {}
+        for name, x, y, _ in placements:
+            img = scaled[name]
+            left = round(x * scale - img.width / 2)
+            top = round(y * scale - img.height / 2)
+
+            for tile_y in range(top // TILE_SIZE, (top + img.height - 1) // TILE_SIZE + 1):
+                for tile_x in range(left // TILE_SIZE, (left + img.width - 1) // TILE_SIZE + 1):
+                    if (tile_x, tile_y) not in tiles:
+                        tiles[(tile_x, tile_y)] = Image.new('RGBA', (TILE_SIZE, TILE_SIZE))
+
+                    # alpha_composite only takes non-negative destinations, so crop the source instead
+                    dx = left - tile_x * TILE_SIZE
+                    dy = top - tile_y * TILE_SIZE
+                    source = (max(0, -dx), max(0, -dy), min(img.width, TILE_SIZE - dx), min(img.height, TILE_SIZE - dy))
+                    tiles[(tile_x, tile_y)].alpha_composite(img, (max(0, dx), max(0, dy)), source)
+
+        for (tile_x, tile_y), tile in tiles.items():
+            entries.append((get_tile_name(scale, tile_x, tile_y), TILE_SIZE, TILE_SIZE, tile.tobytes()))
+
+    sprite_cache.write_sprite_cache(cache_path, entries)
+
+    return len(entries)
@@ -0,0 +1,143 @@
+import base64
+import struct
+import sys
+from array import array
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# the passive tree url format of the official site and most planners: base64url of
+#   version (u32), class (u8), ascendancy (u8)
+#   version 4: fullscreen (u8), then node ids (u16) up to the end
+#   version 5+: node count (u8), node ids (u16), cluster node count (u8), cluster node ids (u16)
+#   version 6: mastery count (u8), then effect id (u16) and mastery node id (u16) pairs
+# everything is big endian. the ascendancy byte keeps the ascendancy in its lowest two bits
+
+URL_PREFIX = "https://www.pathofexile.com/passive-skill-tree/"
+CODE_VERSION = 6
+HEADER = struct.Struct('>IBB')
+
+class DecodedBuild(NamedTuple):
+    version: int
+    class_index: int
+    # 0 for none, otherwise 1 + the position in the class's ascendancies
+    ascendancy_index: int
+    nodes: array
+    cluster_nodes: array
+    # mastery node id -> selected effect id
+    masteries: Dict[int, int]
+
+def get_code(url: str) -> str:
+    # accepts a full url, a url with a query or fragment, or just the code
+    code = url.strip().split('?')[0].split('#')[0].rstrip('/').rsplit('/', 1)[-1]
+    return code.replace('+', '-').replace('/', '_')
+
+def split_code(url: str) -> Tuple[int, int, int, bytes, bytes, bytes]:
+    # version, class, ascendancy and the raw node, cluster node and mastery sections of a code
+    code = get_code(url)
+    try:
+        data = base64.urlsafe_b64decode(code + '=' * (-len(code) % 4))
+    except ValueError as e:
+        raise ValueError(f"Not a tree code: {code}") from e
+
+    if len(data) < HEADER.size:
+        raise ValueError("Truncated tree code")
+
+    version, class_index, ascendancy = HEADER.unpack_from(data)
+    if version < 4 or version > CODE_VERSION:
+        raise ValueError(f"Unsupported tree code version {version}")
+
+    if version == 4:
+        # a fullscreen byte, then nodes up to the end
+        start = HEADER.size + 1
+        nodes = data[start:start + (len(data) - start) // 2 * 2]
+        return version, class_index, ascendancy & 3, nodes, b'', b''
+
+    sections = []
+    offset = HEADER.size
+    # nodes, cluster nodes and for version 6 masteries, each a count and then u16s
+    for size in (2, 2, 4 if version >= 6 else 0):
+        count = data[offset] if size and offset < len(data) else 0
+        section = data[offset + 1:offset + 1 + count * size]
+        if len(section) != count * size:
+            raise ValueError("Truncated tree code")
+        sections.append(section)
+        offset += 1 + count * size
+
+    return (version, class_index, ascendancy & 3, *sections)
+
+def unpack_ids(sections: List[bytes]) -> List[array]:
+    # big endian u16s of every section unpacked in one go, then split up again
+    ids = array('H', b''.join(sections))
+    if sys.byteorder == 'little':
+        ids.byteswap()
+
+    result = []
+    offset = 0
+    for section in sections:
+        result.append(ids[offset:offset + len(section) // 2])
+        offset += len(section) // 2
+
+    return result
+
+def decode_tree_urls(urls: Iterable[str]) -> List[DecodedBuild]:
+    # bulk decoding for headless use: the ids of all codes are byte swapped as one array
+    # instead of being unpacked node by node
+    headers = []
+    sections = []
+    for url in urls:
+        version, class_index, ascendancy, nodes, cluster_nodes, masteries = split_code(url)
+        headers.append((version, class_index, ascendancy))
+        sections += (nodes, cluster_nodes, masteries)
+
+    ids = unpack_ids(sections)
+
+    builds = []
+    for i, (version, class_index, ascendancy) in enumerate(headers):
+        nodes, cluster_nodes, pairs = ids[i * 3:i * 3 + 3]
+        masteries = {pairs[k + 1]: pairs[k] for k in range(0, len(pairs), 2)}
+        builds.append(DecodedBuild(version, class_index, ascendancy, nodes, cluster_nodes, masteries))
+
+    return builds
+
+def decode_tree_url(url: str) -> DecodedBuild:
+    return decode_tree_urls([url])[0]
+
+def encode_tree_url(class_index: int, ascendancy_index: int, nodes: Iterable[int], masteries: Dict[int, int],
+                    cluster_nodes: Iterable[int] = (), prefix: str = URL_PREFIX) -> str:
+    nodes = sorted(nodes)
+    cluster_nodes = sorted(cluster_nodes)
+    pairs = [value for node, effect in sorted(masteries.items()) for value in (effect, node)]
+    if len(nodes) > 255 or len(cluster_nodes) > 255 or len(masteries) > 255:
+        raise ValueError("Too many nodes for a tree code")
+
+    # ids are stored in 16 bits, array would raise OverflowError for anything larger
+    for value in (*nodes, *cluster_nodes, *pairs):
+        if not 0 <= value <= 0xFFFF:
+            raise ValueError(f"Id {value} doesn't fit in a tree code")
+
+    nodes = array('H', nodes)
+    cluster_nodes = array('H', cluster_nodes)
+    pairs = array('H', pairs)
+
+    if sys.byteorder == 'little':
+        for ids in (nodes, cluster_nodes, pairs):
+            ids.byteswap()
+
+    data = (HEADER.pack(CODE_VERSION, class_index, ascendancy_index)
+            + bytes((len(nodes),)) + nodes.tobytes()
+            + bytes((len(cluster_nodes),)) + cluster_nodes.tobytes()
+            + bytes((len(masteries),)) + pairs.tobytes())
+
+    return prefix + base64.urlsafe_b64encode(data).decode()
+
+def get_ascendancy_name(data: dict, class_index: int, ascendancy_index: int) -> Optional[str]:
+    if ascendancy_index == 0:
+        return None
+
+    return data['classes'][class_index]['ascendancies'][ascendancy_index - 1]['name']
+
+def get_ascendancy_index(data: dict, class_index: int, ascendancy_name: Optional[str]) -> int:
+    for i, ascendancy in enumerate(data['classes'][class_index]['ascendancies']):
+        if ascendancy['name'] == ascendancy_name:
+            return i + 1
+
+    return 0
@@ -0,0 +1,143 @@
+import argparse
+import json
+import os
+import sys
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from time import perf_counter
+from typing import Iterable, Iterator, List, Optional, TextIO
+
+import tree_cache
+from build_code import decode_tree_urls, get_ascendancy_name
+from tree_engine import TreeEngine
+
+# builds handed to a worker process at a time
+CHUNK_SIZE = 256
+
+# evaluates builds without the gui, one per input line, writing one json result per line.
+# a line is either a list of node ids separated by spaces or commas, with the class taken from
+# the class start among them, a json object {"nodes": [...], "class": 0, "ascendancy": "..."}
+# or a passive tree url
+#
+#   python evaluate_builds.py builds.txt > results.jsonl
+#   cat builds.txt | python evaluate_builds.py --workers 8
+
+engine: Optional[TreeEngine] = None
+
+def load_tree(source: str, target: str) -> tree_cache.CompiledTree:
+    # stdout carries the results, so the load timing goes to stderr
+    with redirect_stdout(sys.stderr):
+        return tree_cache.load_tree(source, target)
+
+def init_worker(source: str, target: str) -> None:
+    # every worker maps the compiled tree once and reuses one engine for all of its builds
+    global engine
+    engine = TreeEngine(load_tree(source, target))
+
+def is_tree_url(line: str) -> bool:
+    return not line.startswith('{') and not line.replace(',', ' ').replace(' ', '').isdigit()
+
+def parse_build(line: str) -> dict:
+    if line.startswith('{'):
+        return json.loads(line)
+
+    return {'nodes': line.replace(',', ' ').split()}
+
+def parse_tree_urls(lines: List[str]) -> List[dict]:
+    # the urls of a chunk are decoded together, if one of them is bad they are decoded one
+    # by one so it only fails itself
+    try:
+        decoded = decode_tree_urls(lines)
+    except (ValueError, IndexError) as e:
+        if len(lines) == 1:
+            return [{'error': str(e)}]
+        return [build for line in lines for build in parse_tree_urls([line])]
+
+    return [{'nodes': [str(node_id) for node_id in build.nodes], 'class': build.class_index,
+             'ascendancy': get_ascendancy_name(engine.tree.data, build.class_index, build.ascendancy_index)}
+            for build in decoded]
+
+def evaluate_build(build: dict) -> str:
+    if 'error' in build:
+        return json.dumps({'valid': False, 'error': build['error']})
+
+    try:
+        result = engine.evaluate([str(node_id) for node_id in build['nodes']], build.get('class'), build.get('ascendancy'))
+    except (ValueError, KeyError, IndexError, TypeError) as e:
+        result = {'valid': False, 'error': str(e)}
+
+    return json.dumps(result)
+
+def evaluate_chunk(lines: List[str]) -> List[str]:
+    builds = [None] * len(lines)
+    urls = [i for i, line in enumerate(lines) if is_tree_url(line)]
+    if urls:
+        for i, build in zip(urls, parse_tree_urls([lines[i] for i in urls])):
+            builds[i] = build
+
+    for i, line in enumerate(lines):
+        if builds[i] is None:
+            try:
+                builds[i] = parse_build(line)
+            except ValueError as e:
+                builds[i] = {'error': str(e)}
+
+    return [evaluate_build(build) for build in builds]
+
+def read_chunks(lines: Iterable[str]) -> Iterator[List[str]]:
+    builds = (line.strip() for line in lines if line.strip() and not line.startswith('#'))
+    while True:
+        chunk = list(islice(builds, CHUNK_SIZE))
+        if not chunk:
+            break
+        yield chunk
+
+def run(lines: Iterable[str], output: TextIO, source: str = 'data.json', target: str = 'cache/tree.bin', workers: int = 0) -> int:
+    # compile once up front, otherwise every worker would race to compile the cache
+    load_tree(source, target)
+
+    count = 0
+    chunks = read_chunks(lines)
+    if workers == 1:
+        init_worker(source, target)
+        for results in map(evaluate_chunk, chunks):
+            output.writelines(result + '\n' for result in results)
+            count += len(results)
+        return count
+
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(source, target)) as executor:
+        # map submits everything it is given at once, so the input is fed to it in batches to
+        # keep memory flat on long streams. results keep the input order
+        while True:
+            batch = list(islice(chunks, workers))
+            if not batch:
+                break
+
+            for results in executor.map(evaluate_chunk, batch):
+                output.writelines(result + '\n' for result in results)
+                count += len(results)
+
+    return count
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check passive tree builds for validity, orphaned nodes and point counts")
+    parser.add_argument('builds', nargs='?', help="file with one build per line, stdin if omitted")
+    parser.add_argument('--workers', type=int, default=0, help="worker processes, all cores if 0")
+    parser.add_argument('--data', default='data.json', help="tree data the builds are for")
+    parser.add_argument('--cache', default='cache/tree.bin', help="compiled tree cache")
+    args = parser.parse_args()
+
+    start = perf_counter()
+    if args.builds is None:
+        count = run(sys.stdin, sys.stdout, args.data, args.cache, args.workers)
+    else:
+        with open(args.builds) as f:
+            count = run(f, sys.stdout, args.data, args.cache, args.workers)
+
+    seconds = perf_counter() - start
+    print(f"Evaluated {count} builds in {seconds:.3f} seconds ({count / max(seconds, 1e-9):.0f} builds per second)", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+from array import array
+from math import atan2, cos, degrees, dist, radians, sin
+from typing import Dict, List, Tuple
+
+from util import get_orbit_angle
+
+# node positions and connector shapes for the whole tree, computed in one pass when the tree is
+# compiled and stored in its cache, see tree_cache. nodes, connections and headless code read
+# these instead of doing their own trig
+
+# tree data coordinates to scene coordinates
+TREE_SCALE = 0.3835
+
+def get_connection_pairs(data: dict) -> List[Tuple[str, str]]:
+    # the connections drawn on the tree, ascendancy nodes only connect among themselves and
+    # class starts and masteries aren't connected at all
+    pairs = []
+    for node in data['nodes'].values():
+        if 'out' not in node:
+            continue
+
+        # root node
+        if 'skill' not in node:
+            continue
+
+        if 'classStartIndex' in node:
+            continue
+
+        is_ascendancy = 'ascendancyName' in node
+
+        node_id = str(node['skill'])
+        for out in node['out']:
+            out_node = data['nodes'][out]
+
+            if 'classStartIndex' in out_node:
+                continue
+
+            if 'isMastery' in node or 'isMastery' in out_node:
+                continue
+
+            if ('ascendancyName' in out_node and not is_ascendancy
+                or 'ascendancyName' not in out_node and is_ascendancy):
+                continue
+
+            # both ends need a position
+            if 'group' not in node or 'group' not in out_node:
+                continue
+
+            pairs.append((node_id, str(out_node['skill'])))
+
+    return pairs
+
+def compute_node_geometry(ids: List[str], data: dict) -> Tuple[array, array]:
+    # x, y per node and the angle of the node on its orbit in degrees clockwise from the top,
+    # nan for nodes that aren't on the tree
+    # TODO: handle clusters and passives given by jewels
+    positions = array('d')
+    angles = array('d')
+    nan = float('nan')
+    orbit_radii = data['constants']['orbitRadii']
+
+    for node_id in ids:
+        node = data['nodes'][node_id]
+        orbit = node.get('orbit')
+        orbit_index = node.get('orbitIndex')
+        if orbit_index is None or orbit is None or 'group' not in node:
+            positions.extend((nan, nan))
+            angles.append(nan)
+            continue
+
+        angle = get_orbit_angle(orbit, orbit_index, data)
+        group = data['groups'][str(node['group'])]
+        radius = orbit_radii[orbit] * TREE_SCALE
+        theta = radians(angle - 90)
+
+        positions.extend((cos(theta) * radius + group['x'] * TREE_SCALE,
+                          sin(theta) * radius + group['y'] * TREE_SCALE))
+        angles.append(angle)
+
+    return positions, angles
+
+def compute_edge_geometry(pairs: List[Tuple[str, str]], index: Dict[str, int], positions: array, angles: array, data: dict) -> Dict[str, array]:
+    # per connection: its two node indices, whether it follows an orbit, the direction of a line
+    # or the start angle of an arc (both in Qt's degrees), the sweep of an arc and the length
+    nodes = data['nodes']
+    orbit_radii = data['constants']['orbitRadii']
+
+    edge_nodes = array('i')
+    edge_arc = array('b')
+    edge_angle = array('d')
+    edge_span = array('d')
+    edge_length = array('d')
+
+    for first_id, second_id in pairs:
+        first = index[first_id]
+        second = index[second_id]
+        first_node = nodes[first_id]
+        second_node = nodes[second_id]
+        edge_nodes.extend((first, second))
+
+        first_pos = (positions[first * 2], positions[first * 2 + 1])
+        second_pos = (positions[second * 2], positions[second * 2 + 1])
+
+        is_arc = first_node.get('orbit') == second_node.get('orbit') and first_node.get('group') == second_node.get('group')
+        edge_arc.append(is_arc)
+
+        if is_arc:
+            span = angles[second] - angles[first]
+            span = (span + 180) % 360 - 180
+            span = -span
+
+            edge_angle.append((90 - angles[first]) % 360)
+            edge_span.append(span)
+            edge_length.append(radians(abs(span)) * orbit_radii[first_node['orbit']] * TREE_SCALE)
+        else:
+            edge_angle.append(degrees(atan2(second_pos[1] - first_pos[1], second_pos[0] - first_pos[0])))
+            edge_span.append(0)
+            edge_length.append(dist(first_pos, second_pos))
+
+    return {
+        'edges': edge_nodes,
+        'edgearc': edge_arc,
+        'edgeang': edge_angle,
+        'edgespan': edge_span,
+        'edgelen': edge_length,
+    }
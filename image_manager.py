@@ -1,103 +1,218 @@
 from time import perf_counter
-from typing import Dict
-from requests.utils import urlparse
-import urllib
+import json
 import os
-from PIL import Image, ImageQt, ImageOps, ImageEnhance
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+from PyQt5 import QtCore, QtGui
 import threading
 
+import sprite_cache
+from asset_pipeline import CONNECTOR_SCALES, AssetPipeline, get_scaled_name
+from background import get_tile_name
+
+# upper bound on the pixels of materialised skill sprites kept alive at once. a byte budget
+# rather than a count, so everything visible at mid zoom fits whatever the icon sizes are
+SPRITE_LRU_BYTES = 96 * 1024 * 1024
+FRAME_SHAPES_PATH = "cache/frame_shapes.json"
+
 data = None
 images = {}
+sheets = {}
+sprites = OrderedDict()
+sprites_bytes = 0
+sprites_lock = threading.Lock()
+# sprites the prewarm worker still has to materialise, replaced by every prewarm call
+prewarm_keys = []
+prewarm_condition = threading.Condition()
+prewarm_thread = None
+connectors = {}
+connector_pixmaps = {}
+background_tiles = None
+# asset name -> key of the exact file it was loaded from, for caches derived from assets
+asset_keys = {}
+frame_shapes = {}
+
+class SpriteSheet:
+    # a split sprite sheet from the sprite cache; sprites are only turned into QImages when asked for
+    def __init__(self, path: str):
+        self.path = path
+        cache = sprite_cache.open_sprite_cache(path)
+        if cache is None:
+            raise IOError(f"Missing or stale sprite cache {path}")
+
+        self.buffer, self.entries = cache
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.entries
 
-def init(data: dict) -> None:
+    def get_image(self, name: str) -> QtGui.QImage:
+        width, height, start = self.entries[name]
+        image = QtGui.QImage(self.buffer[start:start + width * height * 4], width, height, width * 4, QtGui.QImage.Format.Format_RGBA8888)
+        # detach from the python buffer
+        return image.copy()
+
+def init(data: dict, base_url: Optional[str] = None) -> None:
+    global background_tiles
     data = data
     begin_init = perf_counter()
-    
-    # sprites
-    threads = []
-    for sheet in data['skillSprites'].items():
-        thread = threading.Thread(target=get_and_split_sheet, args=(sheet,))
-        thread.start()
-        threads.append(thread)
-    
-    #assets
+
+    pipeline = AssetPipeline(base_url)
+    sheet_caches, asset_files, connector_cache, background_cache = pipeline.run(data)
+
+    start = perf_counter()
+    for sheet_type, cache_path in sheet_caches.items():
+        sheets[sheet_type] = SpriteSheet(cache_path)
+
     images['assets'] = {}
-    for asset in data['assets'].items():
-        thread = threading.Thread(target=get_asset, args=(asset,))
-        thread.start()
-        threads.append(thread)
-    
-    for thread in threads:
-        thread.join()                   
-
-    images['connectors'] = {}
-    # generate connector images
-    for state in ['Active', 'Intermediate', 'Normal']:        
-        for i in range(1, 7):
-            img = Image.open(f"sprites/Orbit{i}{state}.png")
-            combined = Image.new('RGBA', (img.width * 2, img.height * 2))
-            combined.paste(img, (0, 0))
-            combined.paste(ImageOps.mirror(img), (img.width, 0))
-            combined.paste(ImageOps.flip(img), (0, img.height))
-            combined.paste(ImageOps.mirror(ImageOps.flip(img)), (img.width, img.height))
-            images['connectors'][f"Orbit{i}{state}"] = ImageQt.ImageQt(combined)
-            
-            if state == 'Normal':
-                img = ImageEnhance.Brightness(img).enhance(3)
-                combined = Image.new('RGBA', (img.width * 2, img.height * 2))
-                combined.paste(img, (0, 0))
-                combined.paste(ImageOps.mirror(img), (img.width, 0))
-                combined.paste(ImageOps.flip(img), (0, img.height))
-                combined.paste(ImageOps.mirror(ImageOps.flip(img)), (img.width, img.height))
-                images['connectors'][f"Orbit{i}HoverPath"] = ImageQt.ImageQt(combined)
-        
-        img = Image.open(f"sprites/LineConnector{state}.png")
-        images['connectors'][f"LineConnector{state}"] = ImageQt.ImageQt(img)
-        if state == 'Normal':
-            img = ImageEnhance.Brightness(img).enhance(3)
-            images['connectors'][f"LineConnectorHoverPath"] = ImageQt.ImageQt(img)
-
-    print(f"Initialized {len(images)} images in {perf_counter() - begin_init} seconds")
-
-def get_asset(asset: dict) -> None:
-    asset_name = asset[0]
-    asset_image = list(asset[1].values())[-1]
-    filename = asset_image.split('/')[-1]
-
-    if not os.path.exists(f"sprites/{filename}"):
-        urllib.request.urlretrieve(asset_image, f"sprites/{filename}")
-    
-    img = Image.open(f"sprites/{filename}")
-    img = img.convert('RGBA')
-    images['assets'][asset_name] = ImageQt.ImageQt(img)
-
-def get_and_split_sheet(sheet: dict) -> None:    
-    sprite_category = {}
-    sheet_type = sheet[0]
-    sprite_sheet = sheet[1][-1]
-
-    parsed_url = urlparse(sprite_sheet['filename'])
-    filename = os.path.basename(parsed_url.path)
-    ver = parsed_url.query
-    full_filename = f"{filename}_{ver}.png"
-    
-    os.makedirs("sprites/", exist_ok=True)
-
-    if not os.path.exists(f"sprites/{full_filename}"):
-        urllib.request.urlretrieve(sprite_sheet['filename'], f"sprites/{full_filename}")
-
-    img = Image.open(f"sprites/{full_filename}")
-        
-    for skill in sprite_sheet['coords'].items():
-        skill_path = skill[0]
-        coords = skill[1]
-
-        sprite = img.crop((coords['x'], coords['y'], 
-                            coords['x'] + coords['w'], coords['y'] + coords['h']))
-
-        sprite_category[skill_path] = ImageQt.ImageQt(sprite) 
-
-    images[sheet_type] = sprite_category    
-
-def get_images() -> Dict[str, Dict[str, ImageQt.ImageQt]]:
-    return images
\ No newline at end of file
+    for asset_name, asset_path in asset_files.items():
+        images['assets'][asset_name] = QtGui.QImage(asset_path).convertToFormat(QtGui.QImage.Format.Format_ARGB32)
+        filename = os.path.basename(asset_path)
+        asset_keys[asset_name] = f"{filename}:{pipeline.manifest.get(filename, '')}"
+
+    frame_shapes.clear()
+    if os.path.exists(FRAME_SHAPES_PATH):
+        with open(FRAME_SHAPES_PATH) as f:
+            frame_shapes.update(json.load(f))
+    pipeline.timings['load'] = perf_counter() - start
+
+    start = perf_counter()
+    connector_sheet = SpriteSheet(connector_cache)
+    connectors.clear()
+    # generated connectors are few and painted constantly, so they stay materialised
+    for name in connector_sheet.entries:
+        connectors[name] = connector_sheet.get_image(name)
+    pipeline.timings['connectors'] = perf_counter() - start
+
+    # background tiles stay mapped, only the visible ones are turned into pixmaps
+    background_tiles = SpriteSheet(background_cache)
+
+    print(f"Initialized {len(images['assets'])} assets and {len(sheets)} sprite sheets in {perf_counter() - begin_init} seconds")
+    pipeline.report()
+
+def get_sprite(category: str, name: str) -> QtGui.QImage:
+    global sprites_bytes
+    key = (category, name)
+    with sprites_lock:
+        if key in sprites:
+            sprites.move_to_end(key)
+            return sprites[key]
+
+    image = sheets[category].get_image(name)
+
+    with sprites_lock:
+        if key not in sprites:
+            sprites[key] = image
+            sprites_bytes += image.width() * image.height() * 4
+            # the newest sprite always stays, even if it alone is over budget
+            while sprites_bytes > SPRITE_LRU_BYTES and len(sprites) > 1:
+                _, evicted = sprites.popitem(last=False)
+                sprites_bytes -= evicted.width() * evicted.height() * 4
+
+    return image
+
+def prewarm(keys: Iterable[Tuple[str, str]]) -> None:
+    # materialise sprites that are about to be painted without blocking the caller. one worker
+    # serves every call, keys of an earlier call it hasn't got to yet are dropped
+    global prewarm_keys, prewarm_thread
+    with prewarm_condition:
+        prewarm_keys = [key for key in keys if key not in sprites]
+        prewarm_condition.notify()
+
+        if prewarm_thread is None:
+            prewarm_thread = threading.Thread(target=run_prewarm, daemon=True)
+            prewarm_thread.start()
+
+def run_prewarm() -> None:
+    while True:
+        with prewarm_condition:
+            while not prewarm_keys:
+                prewarm_condition.wait()
+            category, name = prewarm_keys.pop()
+
+        get_sprite(category, name)
+
+def get_asset_image(name: str) -> QtGui.QImage:
+    return images['assets'][name]
+
+def get_image_size(category: str, name: str) -> Tuple[int, int]:
+    # size of an image without materialising it, for layout before anything is painted
+    if category == 'assets':
+        image = get_asset_image(name)
+        return image.width(), image.height()
+
+    width, height, _ = sheets[category].entries[name]
+    return width, height
+
+def get_pixmap(category: str, name: str, scale: float = 1.0) -> QtGui.QPixmap:
+    # category 'assets' for tree assets, otherwise a sprite category. pixmaps can only be
+    # created on the gui thread and are shared by every node painting the same image.
+    # scales below 1 are smoothly downscaled copies for zoomed out painting, see get_mip_scale.
+    # the pixmap cache is bounded, evicted pixmaps are made again from the sprites
+    key = f"sprite:{category}:{name}:{scale}"
+    pixmap = QtGui.QPixmapCache.find(key)
+    if pixmap is None:
+        image = get_asset_image(name) if category == 'assets' else get_sprite(category, name)
+        if scale != 1:
+            image = image.scaled(max(1, round(image.width() * scale)), max(1, round(image.height() * scale)),
+                                 transformMode=QtCore.Qt.TransformationMode.SmoothTransformation)
+        pixmap = QtGui.QPixmap.fromImage(image)
+        QtGui.QPixmapCache.insert(key, pixmap)
+
+    return pixmap
+
+def get_frame_radius(name: str) -> float:
+    # radius of the transparent inner circle of a frame, used as the node's click and hover shape.
+    # only a handful of frames exist, so the pixel scan runs once per frame file and is kept on disk
+    key = asset_keys.get(name, name)
+    if key in frame_shapes:
+        return frame_shapes[key]
+
+    frame = images['assets'][name]
+
+    y_pos = 0
+    # determine inner transparent circle of the frame for clickbox
+    while (y_pos < frame.height() / 2 - 1
+           and QtGui.qAlpha(frame.pixel(int(frame.width() / 2), int(frame.height() / 2 + y_pos))) < 40):
+        y_pos += 1
+
+    frame_shapes[key] = y_pos * 1.3
+
+    os.makedirs(os.path.dirname(FRAME_SHAPES_PATH), exist_ok=True)
+    with open(f"{FRAME_SHAPES_PATH}.tmp", 'w') as f:
+        json.dump(frame_shapes, f, indent=1, sort_keys=True)
+    os.replace(f"{FRAME_SHAPES_PATH}.tmp", FRAME_SHAPES_PATH)
+
+    return frame_shapes[key]
+
+def get_mip_scale(level_of_detail: float) -> float:
+    # smallest pre-scaled image that is still at least as large as it will be drawn
+    for scale in sorted(CONNECTOR_SCALES):
+        if scale >= level_of_detail:
+            return scale
+
+    return 1.0
+
+def get_background_tile(scale: float, tile_x: int, tile_y: int) -> Optional[QtGui.QPixmap]:
+    # None for tiles nothing is drawn on. the cache is bounded, evicted tiles are read again
+    name = get_tile_name(scale, tile_x, tile_y)
+    if name not in background_tiles:
+        return None
+
+    key = f"background:{name}"
+    pixmap = QtGui.QPixmapCache.find(key)
+    if pixmap is None:
+        pixmap = QtGui.QPixmap.fromImage(background_tiles.get_image(name))
+        QtGui.QPixmapCache.insert(key, pixmap)
+
+    return pixmap
+
+def get_connector(name: str, scale: float = 1.0) -> QtGui.QImage:
+    return connectors[get_scaled_name(name, scale)]
+
+def get_connector_pixmap(name: str, scale: float = 1.0) -> QtGui.QPixmap:
+    # pixmaps can only be created on the gui thread, so these are made on first paint
+    key = get_scaled_name(name, scale)
+    if key not in connector_pixmaps:
+        connector_pixmaps[key] = QtGui.QPixmap.fromImage(connectors[key])
+
+    return connector_pixmaps[key]
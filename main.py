@@ -1,36 +1,61 @@
+from contextlib import contextmanager
 from copy import copy
-import io
-import json
 import sys
-from typing import Callable, List
-from collections import deque
+import threading
+import traceback
+from typing import Dict, Iterable, List, Optional, Set
 from time import perf_counter
 
-from PIL import Image, ImageOps, ImageQt
 from PyQt5 import QtCore, QtGui, QtWidgets
 
+import background
 import constants
 import image_manager
+import tree_cache
+from allocation import AllocationTransaction
+from build_code import decode_tree_url, get_ascendancy_name
 from node import Node
 from node_connection import NodeConnection
-
-app = QtWidgets.QApplication(sys.argv)
+from stat_text import parse_stat_weights
+from tree_engine import TreeEngine
+from tree_graph import FLAG_MASTERY
+
+# shared by rendered connections, node sprites and background tiles
+PIXMAP_CACHE_LIMIT_KB = 128 * 1024
+# time spent adding items to the scene per event loop iteration while building
+BUILD_SLICE_SECONDS = 0.008
+
+# below this zoom the tree is drawn as an overview of dots and lines instead of its items
+OVERVIEW_LEVEL_OF_DETAIL = 0.15
+OVERVIEW_CONNECTION_COLORS = {
+    "Active": QtGui.QColor(200, 170, 100),
+    "Intermediate": QtGui.QColor(120, 105, 75),
+    "HoverPath": QtGui.QColor(170, 170, 170),
+    "Normal": QtGui.QColor(70, 75, 80),
+}
+OVERVIEW_NODE_COLORS = {
+    "Active": QtGui.QColor(230, 200, 120),
+    "MasterySelected": QtGui.QColor(230, 200, 120),
+    "MasteryConnected": QtGui.QColor(150, 130, 90),
+    "Inactive": QtGui.QColor(100, 105, 110),
+}
 
 class MainWindow(QtWidgets.QMainWindow):
     class_changed = QtCore.pyqtSignal(str)
     ascendancy_changed = QtCore.pyqtSignal(str)
+    tree_loaded = QtCore.pyqtSignal(object)
+    load_failed = QtCore.pyqtSignal(str)
 
     def __init__(self):
         super().__init__()
 
-        with open('data.json') as f:
-            self.data = json.load(f)
+        self.load_start = perf_counter()
+        self.tree = None
+        self.data = None
+        self.graphics_view = None
 
-        self.graphics_view = SkillTreeView()
-        self.graphics_view.allocated_points_changed.connect(self.update_points)
-        
-        main_layout = QtWidgets.QVBoxLayout()
-        main_layout.setContentsMargins(0, 0, 0, 0)
+        self.main_layout = QtWidgets.QVBoxLayout()
+        self.main_layout.setContentsMargins(0, 0, 0, 0)
         
         controls_layout = QtWidgets.QHBoxLayout()
         controls_layout.setContentsMargins(0, 0, 0, 0)
@@ -43,25 +68,128 @@ class MainWindow(QtWidgets.QMainWindow):
         self.points_label.setFixedHeight(30)
         self.points_label.setText("Points: 0")
 
+        # filled in and enabled once the tree is built, see build_finished
         self.class_selection = QtWidgets.QComboBox()
+        self.class_selection.setEnabled(False)
+        self.ascendancy_selection = QtWidgets.QComboBox()
+        self.ascendancy_selection.setEnabled(False)
+        # hover paths prefer these stats among the shortest ones, see SkillTreeView.set_stat_weights
+        self.stat_weights = QtWidgets.QLineEdit()
+        self.stat_weights.setPlaceholderText("Path stat weights, e.g. maximum life=0.02; mana=0.01")
+        self.stat_weights.setEnabled(False)
+
+        self.progress_bar = QtWidgets.QProgressBar()
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.setFormat("Loading %p%")
+
+        controls_layout.addWidget(self.points_label)
+        controls_layout.addWidget(self.class_selection)
+        controls_layout.addWidget(self.ascendancy_selection)
+        controls_layout.addWidget(self.stat_weights)
+        controls_layout.addWidget(self.progress_bar)
+
+        # stands in for the tree view until the tree data and assets are loaded
+        self.placeholder = QtWidgets.QLabel("Loading tree...")
+        self.placeholder.setAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
+
+        self.main_layout.addWidget(controls_widget)
+        self.main_layout.addWidget(self.placeholder)
+        self.setCentralWidget(QtWidgets.QWidget())
+        self.centralWidget().setLayout(self.main_layout)
+
+        self.tree_loaded.connect(self.start_build)
+        self.load_failed.connect(self.show_load_error)
+        threading.Thread(target=self.load, daemon=True).start()
+
+    def load(self) -> None:
+        # runs on a worker thread: compiling the tree and fetching and splitting assets don't
+        # need the gui, the signals hand the result or the error back to the gui thread
+        try:
+            tree = tree_cache.load_tree()
+            image_manager.init(tree.data)
+        except Exception as e:
+            traceback.print_exc()
+            self.load_failed.emit(f"{type(e).__name__}: {e}")
+            return
+
+        self.tree_loaded.emit(tree)
+
+    def show_load_error(self, message: str) -> None:
+        self.progress_bar.hide()
+        self.placeholder.setText(f"Couldn't load the tree:\n{message}")
+
+    def start_build(self, tree: tree_cache.CompiledTree) -> None:
+        self.tree = tree
+        self.data = tree.data
+
+        self.graphics_view = SkillTreeView(self.tree, self.load_start)
+        self.graphics_view.allocated_points_changed.connect(self.update_points)
+        self.graphics_view.build_progress.connect(self.update_progress)
+        self.graphics_view.build_finished.connect(self.build_finished)
+
+        self.main_layout.replaceWidget(self.placeholder, self.graphics_view)
+        self.placeholder.deleteLater()
+
+        self.graphics_view.build_tree()
+
+    def update_progress(self, done: int, total: int) -> None:
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(done)
+
+    def build_finished(self) -> None:
+        self.progress_bar.hide()
+
         self.class_selection.addItems([clazz['name'] for clazz in self.data['classes']])
         self.class_selection.currentIndexChanged.connect(self.graphics_view.class_changed)
         self.class_selection.currentTextChanged.connect(self.populate_ascendancies)
         self.graphics_view.class_changed(self.class_selection.currentIndex())
 
-        self.ascendancy_selection = QtWidgets.QComboBox()
         self.populate_ascendancies(self.class_selection.currentText())    
         self.ascendancy_selection.currentTextChanged.connect(self.graphics_view.ascendancy_changed) 
         self.graphics_view.ascendancy_changed(self.ascendancy_selection.currentText())        
 
-        controls_layout.addWidget(self.points_label)
-        controls_layout.addWidget(self.class_selection)
-        controls_layout.addWidget(self.ascendancy_selection)
+        self.class_selection.setEnabled(True)
+        self.ascendancy_selection.setEnabled(True)
+        self.stat_weights.editingFinished.connect(self.stat_weights_changed)
+        self.stat_weights.setEnabled(True)
+
+        QtWidgets.QShortcut(QtGui.QKeySequence.StandardKey.Undo, self, self.graphics_view.undo)
+        QtWidgets.QShortcut(QtGui.QKeySequence.StandardKey.Redo, self, self.graphics_view.redo)
+        QtWidgets.QShortcut(QtGui.QKeySequence.StandardKey.Copy, self, self.copy_build)
+        QtWidgets.QShortcut(QtGui.QKeySequence.StandardKey.Paste, self, self.paste_build)
+        QtWidgets.QShortcut(QtGui.QKeySequence(QtCore.Qt.Key.Key_Escape), self, self.graphics_view.clear_planned_targets)
+
+    def stat_weights_changed(self) -> None:
+        try:
+            self.graphics_view.set_stat_weights(parse_stat_weights(self.stat_weights.text()))
+        except ValueError as e:
+            print(f"Couldn't parse stat weights: {e}")
+
+    def copy_build(self) -> None:
+        try:
+            code = self.graphics_view.export_build()
+        except (ValueError, IndexError, KeyError) as e:
+            print(f"Couldn't export build: {e}")
+            return
 
-        main_layout.addWidget(controls_widget)
-        main_layout.addWidget(self.graphics_view)
-        self.setCentralWidget(QtWidgets.QWidget())
-        self.centralWidget().setLayout(main_layout)
+        QtWidgets.QApplication.clipboard().setText(code)
+
+    def paste_build(self) -> None:
+        try:
+            self.graphics_view.import_build(QtWidgets.QApplication.clipboard().text())
+        except (ValueError, IndexError, KeyError) as e:
+            print(f"Couldn't import build: {e}")
+            return
+
+        # follow the build's class and ascendancy without applying them to the tree again
+        engine = self.graphics_view.engine
+        self.class_selection.blockSignals(True)
+        self.ascendancy_selection.blockSignals(True)
+        self.class_selection.setCurrentIndex(engine.class_index)
+        self.populate_ascendancies(self.class_selection.currentText())
+        self.ascendancy_selection.setCurrentText(engine.ascendancy or 'None')
+        self.class_selection.blockSignals(False)
+        self.ascendancy_selection.blockSignals(False)
 
     def populate_ascendancies(self, class_name: str) -> None:
         self.ascendancy_selection.clear()
@@ -74,6 +202,8 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def update_points(self, points: int) -> None:
         self.points_label.setText(f"Points: {points}")
+        # the build's stat totals, see TreeEngine.stat_totals
+        self.points_label.setToolTip('\n'.join(self.graphics_view.engine.stat_totals.format()))
 
 class MainLayout(QtWidgets.QBoxLayout):
     def __init__(self, parent, *args, **kwargs):
@@ -81,20 +211,30 @@ class MainLayout(QtWidgets.QBoxLayout):
 
 class SkillTreeView(QtWidgets.QGraphicsView):
     allocated_points_changed = QtCore.pyqtSignal(int)
+    # items added so far and in total while the scene is being built, see build_tree
+    build_progress = QtCore.pyqtSignal(int, int)
+    build_finished = QtCore.pyqtSignal()
 
-    def __init__(self):
+    def __init__(self, tree: tree_cache.CompiledTree, load_start: Optional[float] = None):
         super().__init__()
 
-        with open('data.json') as f:
-            self.data = json.load(f)
+        # expects image_manager to be initialised already, see MainWindow.load
+        self.load_start = load_start if load_start is not None else perf_counter()
+        self.first_frame_reported = False
+
+        self.compiled_tree = tree
+        self.data = tree.data
 
-        self.class_roots = [""] * len(self.data['classes'])
-        for root_node in self.data['nodes']['root']['out']:
-            self.class_roots[self.data['nodes'][root_node]['classStartIndex']] = root_node
+        self.graph = tree.graph
+        self.tree_index = tree.index
+        self.class_roots = [self.graph.id_of(index) for index in self.tree_index.class_starts]
+        self.ascendancy_roots = {name: self.graph.id_of(index) for name, index in self.tree_index.ascendancy_starts.items()}
 
-        self.ascendancy_roots = {}
-        self.class_index = 0
-        self.ascendancy = None
+        # allocation state and rules, the view mirrors it into the scene
+        self.engine = TreeEngine(tree)
+        self.allocated = self.engine.allocated
+        self.stats = self.engine.stats
+        self.history = self.engine.history
 
         constants.init(self.data['constants'])
         
@@ -103,7 +243,9 @@ class SkillTreeView(QtWidgets.QGraphicsView):
         max_x = self.data['max_x']
         max_y = self.data['max_y']
 
-        image_manager.init(self.data)
+        # rendered connections and node sprites are kept in the pixmap cache, see
+        # NodeConnection.get_pixmap and image_manager.get_pixmap
+        QtGui.QPixmapCache.setCacheLimit(PIXMAP_CACHE_LIMIT_KB)
 
         self.setScene(QtWidgets.QGraphicsScene())
         self.setSceneRect(min_x - 1000, min_y - 1000, max_x - min_x, max_y - min_y)
@@ -135,76 +277,203 @@ class SkillTreeView(QtWidgets.QGraphicsView):
 
         self.hovered_node = None
         self.hover_path = []
+        # targets picked to be allocated together and the nodes that takes, see preview_targets
+        self.planned_targets: List[str] = []
+        self.plan_preview: List[str] = []
         self.scene_mouse_pos = QtCore.QPoint()
-
-        self.build_tree()
-
+        self.tooltip_rect = None
+
+        # nodes whose state changed during the current operation, see invalidation
+        self.dirty_nodes: Set[Node] = set()
+        self.invalidation_depth = 0
+
+        # parent of every node and connection, hidden as a whole while the overview is shown
+        self.detail_layer = QtWidgets.QGraphicsRectItem()
+        self.detail_layer.setFlag(QtWidgets.QGraphicsItem.GraphicsItemFlag.ItemHasNoContents, True)
+        self.overview = False
+        self.overview_paths = None
+
+        # scene construction state, see build_tree. while building, the view pans and zooms but
+        # nodes ignore clicks and hovers, allocation expects every node to exist
+        self.building = False
+        self.pending_nodes = []
+        self.pending_connections = {}
+        self.build_index = 0
+        self.build_total = 0
+        self.build_timer = QtCore.QTimer(self)
+        self.build_timer.setInterval(0)
+        self.build_timer.timeout.connect(self.build_batch)
+
+
+    @contextmanager
+    def invalidation(self):
+        # batches the repaints of everything an operation changes into a single flush at its end
+        self.invalidation_depth += 1
+        try:
+            yield
+        finally:
+            self.invalidation_depth -= 1
+            if self.invalidation_depth == 0:
+                self.flush_invalidation()
+
+    def mark_dirty(self, node: Node) -> None:
+        self.dirty_nodes.add(node)
+        if self.invalidation_depth == 0:
+            self.flush_invalidation()
+
+    def flush_invalidation(self) -> None:
+        # everything the operation allocated or deallocated becomes one undo step
+        self.history.commit()
+
+        dirty = self.dirty_nodes
+        self.dirty_nodes = set()
+
+        nodes = set(dirty)
+        connections = set()
+        for node in dirty:
+            # masteries look different once any of their neighbours is allocated
+            nodes.update(self.get_mastery_neighbors(node.id))
+            connections.update(node.connections)
+
+        # both only update their own rect, and only if their state actually changed
+        for node in nodes:
+            node.refresh_state()
+
+        for connection in connections:
+            connection.refresh_state()
+
+        if dirty:
+            self.overview_paths = None
+            if self.overview:
+                self.viewport().update()
+
+        self.update_tooltip()
 
     def class_changed(self, class_index: int) -> None:
-        self.class_index = class_index
-        self.ascendancy_changed("None")
+        with self.invalidation():
+            self.engine.class_index = class_index
+            self.ascendancy_changed("None")
 
-        self.test_unreachable(self.class_roots[class_index])
+            self.test_unreachable(self.class_roots[class_index])
 
-        for class_root in self.class_roots:
-            self.nodes[class_root].active = False
-        
-        self.nodes[self.class_roots[class_index]].active = True
-        self.viewport().update()
+            for class_root in self.class_roots:
+                self.nodes[class_root].active = False
+            
+            self.nodes[self.class_roots[class_index]].active = True
 
-    def ascendancy_changed(self, ascendancy_name: str) -> None:
-        for ascendancy_root in self.ascendancy_roots.items():
-            root_name = ascendancy_root[0]
-            root_id = ascendancy_root[1]
-            self.nodes[root_id].active = False
+        # undo steps only make sense within one class and ascendancy
+        self.history.clear()
 
+    def ascendancy_changed(self, ascendancy_name: str) -> None:
+        with self.invalidation():
             # some ascendancies span multiple groups so we can't just deallocate a group here
-            for node in self.nodes.values():
-                if node.ascendancy_name == root_name:
-                    node.active = False
-                    node.update()
+            for ascendancy_nodes in self.tree_index.nodes_by_ascendancy:
+                for index in ascendancy_nodes:
+                    if self.allocated[index]:
+                        self.nodes[self.graph.id_of(index)].active = False
+
+            if ascendancy_name != 'None' and len(ascendancy_name) > 0:
+                self.engine.ascendancy = ascendancy_name
+                self.nodes[self.ascendancy_roots[ascendancy_name]].active = True
+            else:
+                # exported builds and pathing would still use the previous one otherwise
+                self.engine.ascendancy = None
 
-        if ascendancy_name != 'None' and len(ascendancy_name) > 0:
-            self.ascendancy = ascendancy_name
-            self.nodes[self.ascendancy_roots[ascendancy_name]].active = True
+        self.history.clear()
+        self.update_num_nodes()
 
     def node_hovered(self, node: Node) -> None:
-        if self.hovered_node == node or node.active:
+        if self.building or self.hovered_node == node or node.active:
             return
 
         self.hovered_node = node
+        if self.planned_targets:
+            # shows what adding the hovered node to the planned targets would take
+            try:
+                self.set_hover_path(self.get_plan_path(self.planned_targets + [node.id]))
+            except ValueError:
+                pass
+            return
+
+        path = self.path_to(node)
+        path.reverse()
+        self.set_hover_path(path)
+
+    def set_hover_path(self, path: List[str]) -> None:
+        with self.invalidation():
+            for id in self.hover_path:
+                self.nodes[id].on_hover_path = False
 
-        self.hover_path = self.path_to(node)
-        self.hover_path.reverse()
+            self.hover_path = path
 
-        for id in self.hover_path:
-            self.nodes[id].on_hover_path = True
+            for id in self.hover_path:
+                self.nodes[id].on_hover_path = True
 
     def path_to(self, node: Node) -> List[str]:
         if self.is_root_node(node.id):
             return []
 
-        return self.find_shortest_path(node.id)
+        return self.find_best_path(node.id)
 
     def node_unhovered(self) -> None:
-        for id in self.hover_path:
-            self.nodes[id].on_hover_path = False
-
         self.hovered_node = None
+        self.set_hover_path(self.plan_preview)
+
+    def plan_targets(self, node_ids: Iterable[str]) -> List[str]:
+        # the unallocated nodes it takes to allocate all of node_ids together, see
+        # TreeEngine.plan_targets. raises ValueError if one of them can't be connected
+        return [self.graph.id_of(index) for index in self.engine.plan_targets(self.graph.index_of(node_id) for node_id in node_ids)]
+
+    def get_plan_path(self, node_ids: Iterable[str]) -> List[str]:
+        # a plan plus the allocated nodes it attaches to, so its connections light up like a hover path
+        planned = self.plan_targets(node_ids)
+        attached = {self.graph.id_of(neighbor) for node_id in planned for neighbor in self.graph.neighbors_of(self.graph.index_of(node_id))
+                    if self.allocated[neighbor] and not self.graph.has_flag(neighbor, FLAG_MASTERY)}
+
+        return planned + sorted(attached)
+
+    def preview_targets(self, node_ids: Iterable[str]) -> None:
+        # highlights the plan for node_ids with the hover path until the targets are allocated or
+        # cleared. raises ValueError if one of them can't be connected
+        node_ids = list(node_ids)
+        self.plan_preview = self.get_plan_path(node_ids) if node_ids else []
+        self.planned_targets = node_ids
+        self.set_hover_path(self.plan_preview)
+
+    def toggle_planned_target(self, node_id: str) -> None:
+        if self.building:
+            return
 
-    def paintEvent(self, event: QtGui.QPaintEvent) -> None:
-        super().paintEvent(event)
+        targets = [target for target in self.planned_targets if target != node_id]
+        if len(targets) == len(self.planned_targets):
+            targets.append(node_id)
 
-        painter = QtGui.QPainter(self.viewport())
-        painter.setRenderHint(QtGui.QPainter.RenderHint.Antialiasing)
+        try:
+            self.preview_targets(targets)
+        except ValueError as e:
+            print(f"Can't plan {node_id}: {e}")
 
-        if self.hovered_node is None:
+    def clear_planned_targets(self) -> None:
+        self.preview_targets([])
+
+    def allocate_targets(self, node_ids: Iterable[str]) -> None:
+        # the planned targets are kept if they can't be allocated, so one can be dropped again
+        start = perf_counter()
+
+        try:
+            with self.allocation_transaction() as transaction:
+                transaction.allocate(self.plan_targets(node_ids))
+        except ValueError as e:
+            print(f"Can't allocate targets: {e}")
             return
 
+        self.clear_planned_targets()
+        print(f"Allocate targets took {perf_counter() - start} seconds")
+
+    def get_tooltip_layout(self) -> tuple:
+        # returns the stats shown, where the tooltip is drawn and its size
         node_data = self.data['nodes'][self.hovered_node.id]
 
-        painter.setFont(self.tooltip_title_font)
-        
         title_height = self.tooltip_title_metrics.height() + 10
         tooltip_width = self.tooltip_title_metrics.width(node_data['name'])
 
@@ -230,18 +499,67 @@ class SkillTreeView(QtWidgets.QGraphicsView):
         # offset slightly from cursor
         pos.setX(pos.x() + 15)
         pos.setY(pos.y() + 10)
-        
-        tooltip_rect = QtCore.QRectF(pos.x(), pos.y(), width, height)
 
         # move tooltip if it would intersect the viewport rect
         intersected = QtCore.QRect(pos.x(), pos.y(), width, height).intersected(self.viewport().rect())
         if intersected.width() < width:
-            tooltip_rect.moveLeft(pos.x() - width - 25)
             pos.setX(pos.x() - width - 25)
         if intersected.height() < height:
-            tooltip_rect.moveTop(pos.y() - height - 10)
             pos.setY(pos.y() - height - 10)
 
+        return stats, pos, width, height, title_height
+
+    def get_tooltip_rect(self) -> Optional[QtCore.QRect]:
+        if self.hovered_node is None:
+            return None
+
+        _, pos, width, height, _ = self.get_tooltip_layout()
+        return QtCore.QRect(pos.x() - 10, pos.y() - 10, width + 20, height + 20)
+
+    def update_tooltip(self) -> None:
+        # repaints where the tooltip was and where it is now, nothing else
+        tooltip_rect = self.get_tooltip_rect()
+        if tooltip_rect == self.tooltip_rect:
+            if tooltip_rect is not None:
+                self.viewport().update(tooltip_rect)
+            return
+
+        if self.tooltip_rect is not None:
+            self.viewport().update(self.tooltip_rect)
+        if tooltip_rect is not None:
+            self.viewport().update(tooltip_rect)
+
+        self.tooltip_rect = tooltip_rect
+
+    def scrollContentsBy(self, dx: int, dy: int) -> None:
+        super().scrollContentsBy(dx, dy)
+
+        # the tooltip is fixed to the viewport, so it can't be scrolled along with the scene
+        if self.tooltip_rect is not None:
+            self.viewport().update(self.tooltip_rect.translated(dx, dy))
+            self.viewport().update(self.tooltip_rect)
+
+    def paintEvent(self, event: QtGui.QPaintEvent) -> None:
+        super().paintEvent(event)
+
+        if not self.first_frame_reported and len(self.nodes):
+            # the first frame with part of the tree on screen and the view panning and zooming,
+            # nodes only respond once the build finishes
+            self.first_frame_reported = True
+            print(f"First interactive frame after {perf_counter() - self.load_start} seconds")
+
+        painter = QtGui.QPainter(self.viewport())
+        painter.setRenderHint(QtGui.QPainter.RenderHint.Antialiasing)
+
+        if self.hovered_node is None:
+            return
+
+        node_data = self.data['nodes'][self.hovered_node.id]
+        stats, pos, width, height, title_height = self.get_tooltip_layout()
+        tooltip_rect = QtCore.QRectF(pos.x(), pos.y(), width, height)
+
+        painter.setFont(self.tooltip_title_font)
+
         tooltip_path = QtGui.QPainterPath()
         tooltip_path.addRoundedRect(tooltip_rect, 10, 10)
         painter.strokePath(tooltip_path, QtGui.QPen(QtGui.QColorConstants.White, 1))
@@ -258,7 +576,77 @@ class SkillTreeView(QtWidgets.QGraphicsView):
             painter.drawText(QtCore.QRectF(pos.x() + 10, pos.y() + offset, width, (font_height + 5) * lines), QtCore.Qt.AlignmentFlag.AlignVCenter, stat)
             offset += (font_height + 5) * lines
 
-        self.viewport().update(QtCore.QRect(pos.x() - 10, pos.y() - 10, width + 20, height + 20))
+    def drawBackground(self, painter: QtGui.QPainter, rect: QtCore.QRectF) -> None:
+        super().drawBackground(painter, rect)
+
+        painter.setRenderHint(QtGui.QPainter.RenderHint.SmoothPixmapTransform)
+
+        scale = background.get_background_scale(self.transform().m11())
+        if scale is None:
+            self.draw_background_sources(painter, rect)
+            return
+
+        span = background.TILE_SIZE / scale
+        for tile_x, tile_y in background.get_visible_tiles(scale, rect.left(), rect.top(), rect.right(), rect.bottom()):
+            pixmap = image_manager.get_background_tile(scale, tile_x, tile_y)
+            if pixmap is not None:
+                painter.drawPixmap(QtCore.QRectF(tile_x * span, tile_y * span, span, span), pixmap, QtCore.QRectF(pixmap.rect()))
+
+    def draw_background_sources(self, painter: QtGui.QPainter, rect: QtCore.QRectF) -> None:
+        # closer in than the largest tile level only a few backgrounds are visible, so the
+        # full size art is drawn as is
+        for placement_rect, name, mirrored in self.background_placements:
+            if not placement_rect.intersects(rect):
+                continue
+
+            pixmap = image_manager.get_pixmap('assets', name)
+            painter.drawPixmap(placement_rect.topLeft(), pixmap)
+            if mirrored:
+                painter.save()
+                painter.translate(placement_rect.left(), placement_rect.bottom())
+                painter.scale(1, -1)
+                painter.drawPixmap(0, 0, pixmap)
+                painter.restore()
+
+    def drawForeground(self, painter: QtGui.QPainter, rect: QtCore.QRectF) -> None:
+        super().drawForeground(painter, rect)
+
+        if not self.overview:
+            return
+
+        if self.overview_paths is None:
+            self.overview_paths = self.build_overview_paths()
+
+        connection_paths, node_paths = self.overview_paths
+        for state, path in connection_paths.items():
+            pen = QtGui.QPen(OVERVIEW_CONNECTION_COLORS[state], 1.5)
+            pen.setCosmetic(True)
+            painter.strokePath(path, pen)
+
+        for state, path in node_paths.items():
+            painter.fillPath(path, OVERVIEW_NODE_COLORS[state])
+
+    def build_overview_paths(self) -> tuple:
+        # one path per state, so the whole tree is drawn in a handful of calls
+        connection_paths = {}
+        node_paths = {}
+
+        for item in self.detail_layer.childItems():
+            if isinstance(item, NodeConnection):
+                if item.state not in connection_paths:
+                    connection_paths[item.state] = QtGui.QPainterPath()
+                connection_paths[item.state].addPath(item.path)
+            elif item.position is not None and not item.is_class_start:
+                if item.visual_state not in node_paths:
+                    node_paths[item.visual_state] = QtGui.QPainterPath()
+                radius = max(item.bounding_rect.width(), item.bounding_rect.height()) / 3
+                node_paths[item.visual_state].addEllipse(QtCore.QPointF(*item.position), radius, radius)
+
+        # active connections are drawn last so they aren't covered by the rest
+        order = list(OVERVIEW_CONNECTION_COLORS)[::-1]
+        connection_paths = {state: connection_paths[state] for state in order if state in connection_paths}
+
+        return connection_paths, node_paths
 
     def wheelEvent(self, event: QtGui.QWheelEvent) -> None:
         if event.angleDelta().y() > 0:
@@ -266,8 +654,36 @@ class SkillTreeView(QtWidgets.QGraphicsView):
         else:
             self.scale(0.5, 0.5)
 
+        self.update_overview()
+        self.prewarm_visible_sprites()
+
+    def update_overview(self) -> None:
+        # switches between the item scene and the overview paths when the zoom crosses the threshold
+        overview = self.transform().m11() < OVERVIEW_LEVEL_OF_DETAIL
+        if overview != self.overview:
+            self.overview = overview
+            self.detail_layer.setVisible(not overview)
+
+    def showEvent(self, event: QtGui.QShowEvent) -> None:
+        super().showEvent(event)
+        self.prewarm_visible_sprites()
+
+    def prewarm_visible_sprites(self) -> None:
+        if self.overview:
+            return
+
+        keys = set()
+        for item in self.items(self.viewport().rect()):
+            if isinstance(item, Node):
+                category, name = item.get_icon_key()
+                if category != 'assets':
+                    keys.add((category, name))
+
+        image_manager.prewarm(keys)
+
     def mouseMoveEvent(self, event: QtGui.QMouseEvent) -> None:
         self.scene_mouse_pos = event.pos()
+        self.update_tooltip()
         return super().mouseMoveEvent(event)
 
     def mousePressEvent(self, event: QtGui.QMouseEvent) -> None:
@@ -279,25 +695,24 @@ class SkillTreeView(QtWidgets.QGraphicsView):
         self.viewport().unsetCursor()
 
     def has_unallocated_neighbors(self, node_id: str):
-        for neighbor in self.data['nodes'][node_id]['out'] + self.data['nodes'][node_id]['in']:
-            if not self.nodes[neighbor].active and 'isMastery' not in self.data['nodes'][neighbor]:
-                return True
-
-        return False
+        return self.graph.has_unallocated_neighbors(self.graph.index_of(node_id), self.allocated)
 
     def update_num_nodes(self) -> None:
-        num_nodes = 0
-        for node in self.nodes.items():
-            id = node[0]
-            node_obj = node[1]
-
-            if node_obj.active and not self.is_root_node(id) and not node_obj.is_ascendancy_start and not node_obj.is_multiple_choice_option:
-                num_nodes += 1
+        self.allocated_points_changed.emit(self.stats.points)
 
-        self.allocated_points_changed.emit(num_nodes)
+        # a plan is only valid for the allocation it was made for
+        if self.planned_targets:
+            try:
+                self.preview_targets(self.planned_targets)
+            except ValueError:
+                self.clear_planned_targets()
 
     def allocate_to(self, target_id: str) -> None:
-        if self.is_root_node(target_id):
+        if self.building or self.is_root_node(target_id):
+            return
+
+        if self.planned_targets:
+            self.allocate_targets(self.planned_targets + [target_id])
             return
 
         path = []
@@ -308,175 +723,156 @@ class SkillTreeView(QtWidgets.QGraphicsView):
         else:
             path = self.path_to(self.nodes[target_id])
 
-        for node in path[1:]:
-            self.allocate(node)
-        
-        print(f"Allocate to took {perf_counter() - start} seconds")
-        self.update_num_nodes()
-
-    def is_root_node(self, node_id: str) -> bool:
-        return node_id in self.data['nodes']['root']['out']
-
-    def test_unreachable(self, node_id: str) -> None:
-        start = perf_counter()
+        try:
+            with self.allocation_transaction() as transaction:
+                transaction.allocate(path[1:])
+        except ValueError as e:
+            print(f"Can't allocate {target_id}: {e}")
+            return
 
-        self.nodes[node_id].toggle_active()
+        print(f"Allocate to took {perf_counter() - start} seconds")
 
-        unreachable = []
+    def begin_allocation(self) -> AllocationTransaction:
+        return AllocationTransaction()
+
+    @contextmanager
+    def allocation_transaction(self):
+        # commits everything allocated and deallocated in the block as one change
+        transaction = self.begin_allocation()
+        yield transaction
+        self.commit_allocation(transaction)
+
+    def commit_allocation(self, transaction: AllocationTransaction) -> None:
+        # applies a validated transaction with one repaint and one points update, see
+        # TreeEngine.plan_allocation. raises ValueError without changing anything, callers
+        # handling input report it instead of letting it escape into Qt
+        if not transaction:
+            return
 
-        for node in self.nodes:
-            if self.nodes[node].active and not self.is_root_node(node):
-                if not self.is_reachable(self.class_roots[self.class_index], str(node)):
-                    unreachable.append(node)
+        changes = self.engine.plan_allocation(transaction)
 
-        for node in unreachable:
-            self.nodes[node].toggle_active()
+        with self.invalidation():
+            for index, active in changes.items():
+                self.nodes[self.graph.id_of(index)].active = active
 
         self.update_num_nodes()
 
-        print(f"Test unreachable took {perf_counter() - start} seconds")
-
-    def is_reachable(self, node_id: str, target_id: str) -> bool:
-        if self.is_root_node(target_id):
-            return False
-
-        def skip_criteria(id: str) -> bool:
-            return ('isMastery' in self.data['nodes'][id]
-                    or not self.nodes[id].active)
-
-        path = self.bfs(node_id, skip_criteria, target_id)
-
-        return len(path) > 0
-
-    def bfs(self, start: str, skip_criteria: Callable[[str], bool] = lambda x: False, end: str = None) -> List[str]:
-        path = None
-        dist = {start: [start]}
-        q = deque([start])
-        while len(q):
-            at = q.popleft()
-            for next in self.data['nodes'][at]['out'] + self.data['nodes'][at]['in']:
-                if skip_criteria(next):
-                    continue
-
-                is_end = (end is not None and next == end) 
-                if (not self.nodes[next].active and not is_end) and next != start and self.is_root_node(next):
-                    continue
+    def is_root_node(self, node_id: str) -> bool:
+        return self.graph.is_root_node(self.graph.index_of(node_id))
+
+    def set_allocated(self, index: int, active: bool) -> None:
+        self.engine.set_allocated(index, active)
+
+    def snapshot(self) -> bytes:
+        return self.engine.snapshot()
+
+    def restore(self, snapshot: bytes) -> None:
+        # applies a snapshot of the same tree as one undoable change
+        self.apply_delta(self.engine.diff_snapshot(snapshot))
+
+    def import_build(self, url: str) -> None:
+        # loads a tree url as one change: every node that differs is flipped within a single
+        # invalidation instead of being allocated one by one. raises ValueError for bad codes
+        build = decode_tree_url(url)
+        allocated, masteries = self.engine.build_allocation(build)
+
+        with self.invalidation():
+            self.engine.class_index = build.class_index
+            self.engine.ascendancy = get_ascendancy_name(self.data, build.class_index, build.ascendancy_index)
+            self.engine.set_mastery_effects(masteries)
+            self.apply_delta([i for i in range(len(allocated)) if allocated[i] != self.allocated[i]])
+
+        self.history.clear()
+
+    def export_build(self) -> str:
+        return self.engine.export_build()
+
+    def undo(self) -> None:
+        delta = self.history.undo()
+        if delta is not None:
+            self.apply_delta(delta, record=False)
+
+    def redo(self) -> None:
+        delta = self.history.redo()
+        if delta is not None:
+            self.apply_delta(delta, record=False)
+
+    def apply_delta(self, delta: Iterable[int], record: bool = True) -> None:
+        # flips every node in delta with a single repaint and points update
+        self.history.recording = record
+        try:
+            with self.invalidation():
+                for index in delta:
+                    self.nodes[self.graph.id_of(index)].active = not self.allocated[index]
+        finally:
+            self.history.recording = True
 
-                if is_end or (end is None and self.nodes[next].active):
-                    path = dist[at] + [next]
-                    q.clear()
-                    break
+        self.update_num_nodes()
 
-                if next not in dist:
-                    dist[next] = dist[at] + [next]
-                    q.append(next)
+    def test_unreachable(self, node_id: str) -> None:
+        # toggles a node, deallocating whatever that disconnects from the class start
+        if self.building:
+            return
 
-        if path is None:
-            return []
+        start = perf_counter()
 
-        return path
+        try:
+            with self.allocation_transaction() as transaction:
+                if self.nodes[node_id].active:
+                    transaction.deallocate([node_id])
+                else:
+                    transaction.allocate([node_id])
+        except ValueError as e:
+            print(f"Can't toggle {node_id}: {e}")
+            return
 
-    def allocate(self, node_id: str) -> None:
-        if self.nodes[node_id].is_multiple_choice_option: 
-            parent = self.data['nodes'][node_id]['in'][0]
-            parent = self.data['nodes'][parent]
-            for out in parent['out']:
-                if self.nodes[out].is_multiple_choice_option:
-                    self.nodes[out].active = False
+        print(f"Test unreachable took {perf_counter() - start} seconds")
 
-        self.nodes[node_id].toggle_active()
+    def is_reachable(self, node_id: str, target_id: str) -> bool:
+        return self.graph.is_reachable(self.graph.index_of(node_id), self.graph.index_of(target_id), self.allocated)
 
-        if self.nodes[node_id].is_notable:
-            for neighbor in self.data['nodes'][node_id]['out'] + self.data['nodes'][node_id]['in']:
-                if self.nodes[neighbor].is_mastery:
-                    self.nodes[neighbor].update()
+    def get_mastery_neighbors(self, node_id: str) -> List[Node]:
+        masteries = []
+        for neighbor in self.tree_index.node_masteries.get(self.graph.index_of(node_id), []):
+            mastery = self.nodes.get(self.graph.id_of(neighbor))
+            if mastery is not None:
+                masteries.append(mastery)
 
+        return masteries
 
     def is_mastery_active(self, mastery_id: str) -> bool:
-        connected = self.data['nodes'][mastery_id]['out'] + self.data['nodes'][mastery_id]['in']
-
-        return any(self.nodes[node].active for node in connected)
+        return self.engine.is_mastery_active(self.graph.index_of(mastery_id))
 
     def find_shortest_path(self, end: str) -> List[str]:
-        end_in_ascendant = 'ascendancyName' in self.data['nodes'][end] and self.data['nodes'][end]['ascendancyName'] == self.ascendancy       
-
-        def skip_criteria(id) -> bool:
-            if not end_in_ascendant and 'ascendancyName' in self.data['nodes'][id]:
-                return not self.nodes[id].active
+        path = self.engine.find_shortest_path(self.graph.index_of(end))
 
-            if end_in_ascendant and 'ascendancyName' not in self.data['nodes'][id]:
-                return not self.nodes[id].active
+        return [self.graph.id_of(index) for index in path]
 
-            #  or id in self.class_roots
-            return ('isMastery' in self.data['nodes'][id])
+    def find_best_path(self, end: str) -> List[str]:
+        # the shortest path unless stat weights are set, see TreeEngine.find_best_path
+        path = self.engine.find_best_path(self.graph.index_of(end))
 
-        return self.bfs(end, skip_criteria)
+        return [self.graph.id_of(index) for index in path]
 
-    def build_tree(self) -> None:
-        group_background_1 = image_manager.get_images()['assets']['PSGroupBackground1']
-        group_background_2 = image_manager.get_images()['assets']['PSGroupBackground2']
-        group_background_3_base = image_manager.get_images()['assets']['PSGroupBackground3']
-        buffer = QtCore.QBuffer()
-        buffer.open(QtCore.QIODevice.OpenModeFlag.ReadWrite)
-        group_background_3_base.save(buffer, "PNG")
-        group_background_3_base = Image.open(io.BytesIO(buffer.data()))
-        group_background_3 = Image.new('RGBA', (group_background_3_base.width, group_background_3_base.height * 2))
-        group_background_3.paste(group_background_3_base, (0, 0))
-        group_background_3.paste(ImageOps.flip(group_background_3_base), (0, group_background_3_base.height))
-
-
-        # group backgrounds
-        for group in self.data['groups'].items():
-            group_data = group[1]
-
-            if 'ascendancyName' in self.data['nodes'][group_data['nodes'][0]]:
-                continue
-
-            root_nodes = self.data['nodes']['root']['out']
-
-            if any(node in root_nodes for node in group_data['nodes']):
-                continue
+    def set_mastery_effect(self, index: int, effect: Optional[int]) -> None:
+        # selections aren't undo steps, like class and ascendancy changes. the points signal
+        # also refreshes the stat totals shown, see MainWindow.update_points
+        self.engine.set_mastery_effect(index, effect)
+        self.update_num_nodes()
 
-            if 3 in group_data['orbits']:
-                item = QtWidgets.QGraphicsPixmapItem(QtGui.QPixmap.fromImage(ImageQt.ImageQt(group_background_3)))
-                x_pos = group_data['x'] * 0.3835 - group_background_3.width / 2
-                y_pos = group_data['y'] * 0.3835 - group_background_3.height / 2
-                item.setOffset(x_pos, y_pos)
-                self.scene().addItem(item)
-                continue
+    def set_stat_weights(self, weights: Dict[str, float]) -> None:
+        self.engine.set_stat_weights(weights)
 
-            if 2 in group_data['orbits']:
-                item = QtWidgets.QGraphicsPixmapItem(QtGui.QPixmap.fromImage(group_background_2))
-                x_pos = group_data['x'] * 0.3835 - group_background_2.width() / 2
-                y_pos = group_data['y'] * 0.3835 - group_background_2.height() / 2
-                item.setOffset(x_pos, y_pos)
-                self.scene().addItem(item)
-                continue
-
-            if 1 in group_data['orbits']:
-                item = QtWidgets.QGraphicsPixmapItem(QtGui.QPixmap.fromImage(group_background_1))
-                x_pos = group_data['x'] * 0.3835 - group_background_1.width() / 2
-                y_pos = group_data['y'] * 0.3835 - group_background_1.height() / 2
-                item.setOffset(x_pos, y_pos)
-                self.scene().addItem(item)
-                continue
+    def build_tree(self) -> None:
+        # backgrounds aren't scene items, they are painted from the tile cache by drawBackground
+        self.background_placements = []
+        for name, x, y, mirrored in background.get_background_placements(self.data):
+            image = image_manager.get_asset_image(name)
+            height = image.height() * 2 if mirrored else image.height()
+            rect = QtCore.QRectF(x - image.width() / 2, y - height / 2, image.width(), height)
+            self.background_placements.append((rect, name, mirrored))
 
-        # ascendancy backgrounds
-        for group in self.data['groups'].items():
-            group_data = group[1]
-            nodes = group_data['nodes']
-
-            is_ascendancy_group = any('isAscendancyStart' in self.data['nodes'][node] for node in nodes)
-
-            if is_ascendancy_group:
-                ascendancy = self.data['nodes'][nodes[0]]['ascendancyName']
-                image = image_manager.get_images()['assets'][f"Classes{ascendancy}"]
-                item = QtWidgets.QGraphicsPixmapItem(QtGui.QPixmap.fromImage(image))
-                x_pos = group_data['x'] * 0.3835 - image.width() / 2
-                y_pos = group_data['y'] * 0.3835 - image.height() / 2
-                item.setOffset(x_pos, y_pos)
-                self.scene().addItem(item)
-                continue
+        self.scene().addItem(self.detail_layer)
 
         # nodes
         for node in self.data['nodes'].items():
@@ -486,53 +882,73 @@ class SkillTreeView(QtWidgets.QGraphicsView):
             # ignore nodes not in a group, since they are not on the tree
             if 'group' not in node[1]:
                 continue
-                
-            if 'isAscendancyStart' in node[1]:
-                self.ascendancy_roots[node[1]['ascendancyName']] = node[0]
 
-            node_data = node[1]
+            self.pending_nodes.append(node[0])
+
+        # connections, keyed by both of their nodes so they are added once the second one is
+        for edge in range(self.compiled_tree.get_edge_count()):
+            first, second = self.compiled_tree.get_edge_nodes(edge)
+            self.pending_connections.setdefault(self.graph.id_of(first), []).append(edge)
+            self.pending_connections.setdefault(self.graph.id_of(second), []).append(edge)
+
+        # whatever is on screen first, nodes without a position last
+        center = self.mapToScene(self.viewport().rect().center())
+
+        def distance(node_id: str) -> float:
+            pos = self.compiled_tree.get_position(self.graph.index_of(node_id))
+            if pos is None:
+                return float('inf')
+            return (pos[0] - center.x()) ** 2 + (pos[1] - center.y()) ** 2
+
+        self.pending_nodes.sort(key=distance)
+        self.build_index = 0
+        self.build_total = len(self.pending_nodes)
+
+        # items are added from the event loop in time slices, so the view can be panned and
+        # zoomed while the rest of the tree fills in. node clicks and hovers wait for the whole tree
+        self.building = True
+        self.build_timer.start()
+
+    def build_batch(self) -> None:
+        deadline = perf_counter() + BUILD_SLICE_SECONDS
+        while self.build_index < self.build_total and perf_counter() < deadline:
+            node_id = self.pending_nodes[self.build_index]
+            self.build_index += 1
+
+            node_data = self.data['nodes'][node_id]
             node_obj = Node(node_data, self.data['constants'], self.data['groups'], self)
             self.nodes[node_obj.id] = node_obj
-            self.scene().addItem(node_obj)
+            node_obj.setParentItem(self.detail_layer)
 
-        # connections
-        for node in self.data['nodes'].values():
-            if 'out' not in node:
-                continue
-        
-            # root node
-            if 'skill' not in node:
-                continue
+            for edge in self.pending_connections.pop(node_id, []):
+                first, second = (self.graph.id_of(index) for index in self.compiled_tree.get_edge_nodes(edge))
+                if first in self.nodes and second in self.nodes:
+                    connection = NodeConnection(self.nodes[first], self.nodes[second], self.data, edge)
+                    connection.setParentItem(self.detail_layer)
 
-            if 'classStartIndex' in node:
-                continue
+        self.overview_paths = None
+        self.build_progress.emit(self.build_index, self.build_total)
 
-            is_ascendancy = False
-            if 'ascendancyName' in node:
-                is_ascendancy = True
-            
-            node_id = str(node['skill'])
-            for out in node['out']:
-                out_node = self.data['nodes'][out]
-                out_node_id = str(out_node['skill'])
+        if self.build_index < self.build_total:
+            return
 
-                if 'classStartIndex' in out_node:
-                    continue
+        self.build_timer.stop()
+        self.pending_nodes = []
+        self.pending_connections = {}
+        self.building = False
+        self.prewarm_visible_sprites()
 
-                if 'isMastery' in node or 'isMastery' in out_node:
-                    continue
-                
-                if ('ascendancyName' in out_node and not is_ascendancy
-                    or 'ascendancyName' not in out_node and is_ascendancy):
-                    continue
+        print(f"Full load took {perf_counter() - self.load_start} seconds")
+        self.build_finished.emit()
 
-                connection = NodeConnection(self.nodes[node_id], self.nodes[out_node_id], self.data)
-                self.scene().addItem(connection)
+if __name__ == '__main__':
+    # only start the app when run directly, asset_pipeline worker processes may import this module
+    app = QtWidgets.QApplication(sys.argv)
 
+    window = MainWindow()
+    window.setGeometry(100, 100, 1200, 700)
+    window.setWindowTitle('PoE Tree Planner')
+    window.show()
 
-window = MainWindow()
-window.setGeometry(100, 100, 1200, 700)
-window.setWindowTitle('PoE Tree Planner')
-window.show()
+    sys.exit(app.exec_())
 
-sys.exit(app.exec_())
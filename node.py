@@ -1,8 +1,7 @@
-from typing import Union
+from typing import List, Tuple, Union
 from PyQt5.QtWidgets import QGraphicsItem
 from PyQt5 import QtGui, QtCore, QtWidgets
 import image_manager
-from math import cos, sin, radians
 
 class Node(QGraphicsItem):
     #TODO: don't just keep constants and groups in every node
@@ -34,15 +33,20 @@ class Node(QGraphicsItem):
                 self.active_effect_image = node_obj['activeEffectImage']
 
                 self.mastery_effects = node_obj['masteryEffects']
-                self.selected_effect = None
-
-            self.skills_per_orbit = constants['skillsPerOrbit']
-            self.orbit_radii = constants['orbitRadii']
 
             self.tree = tree
+            self.index = tree.graph.index_of(self.id)
+
+            # image layers and bounding rect per visual state, see refresh_state
+            self.visual_state = None
+            self.state_table = {}
+            self.layers = []
+            self.bounding_rect = QtCore.QRectF(0, 0, 0, 0)
 
-            self.active = False
-            self.on_hover_path = False
+            self.tree.set_allocated(self.index, False)
+            self._on_hover_path = False
+            # connections touching this node, refreshed by the view when the node changes
+            self.connections = []
 
             self.position = self.get_position()
 
@@ -61,7 +65,101 @@ class Node(QGraphicsItem):
             print(node_obj)
             raise
 
-        self.active = False
+        self.refresh_state()
+
+    @property
+    def active(self) -> bool:
+        return bool(self.tree.allocated[self.index])
+
+    @active.setter
+    def active(self, active: bool) -> None:
+        if self.active == bool(active):
+            return
+
+        self.tree.set_allocated(self.index, active)
+        self.tree.mark_dirty(self)
+
+    @property
+    def selected_effect(self) -> Union[str, None]:
+        # the selection lives in the engine by effect id, see TreeEngine.mastery_effects
+        effect_id = self.tree.engine.mastery_effects.get(self.index)
+        for effect in self.mastery_effects:
+            if effect['effect'] == effect_id:
+                return effect['stats'][0]
+
+        return None
+
+    @selected_effect.setter
+    def selected_effect(self, selected_effect: str) -> None:
+        for effect in self.mastery_effects:
+            if effect['stats'][0] == selected_effect:
+                self.tree.set_mastery_effect(self.index, effect['effect'])
+                return
+
+    @property
+    def on_hover_path(self) -> bool:
+        return self._on_hover_path
+
+    @on_hover_path.setter
+    def on_hover_path(self, on_hover_path: bool) -> None:
+        if self._on_hover_path == on_hover_path:
+            return
+
+        self._on_hover_path = on_hover_path
+        self.tree.mark_dirty(self)
+
+    def get_visual_state(self) -> str:
+        # hover path highlighting only changes the connectors, so it shares the inactive art
+        if self.is_mastery and self.tree.is_mastery_active(self.id):
+            return "MasterySelected" if self.active else "MasteryConnected"
+
+        return "Active" if self.active else "Inactive"
+
+    def refresh_state(self) -> None:
+        state = self.get_visual_state()
+        if state == self.visual_state:
+            return
+
+        if state not in self.state_table:
+            self.state_table[state] = self.build_state()
+
+        layers, bounding_rect = self.state_table[state]
+        if bounding_rect != self.bounding_rect:
+            self.prepareGeometryChange()
+
+        self.visual_state = state
+        self.layers = layers
+        self.bounding_rect = bounding_rect
+        self.update()
+
+    def build_state(self) -> Tuple[List[Tuple[QtCore.QRectF, Tuple[str, str]]], QtCore.QRectF]:
+        # lays out the images painted for the node's current state, in paint order. only their
+        # sizes are read here, the pixmaps are looked up by key when painted, see paint
+        pos = self.position
+        if pos is None:
+            return [], QtCore.QRectF(0, 0, 0, 0)
+
+        keys = []
+        if self.is_mastery and self.tree.is_mastery_active(self.id):
+            keys.append(('assets', 'PassiveMasteryConnectedButton'))
+
+        keys.append(self.get_icon_key())
+
+        frame_path = self.get_frame_image()
+        if frame_path is not None:
+            keys.append(('assets', frame_path))
+
+        layers = [(QtCore.QRectF(pos[0] - width / 2, pos[1] - height / 2, width, height), key)
+                  for (width, height), key in ((image_manager.get_image_size(*key), key) for key in keys)]
+
+        if self.is_mastery and self.tree.is_mastery_active(self.id):
+            bounding_rect = layers[0][0]
+        elif frame_path is not None:
+            bounding_rect = layers[-1][0]
+        else:
+            bounding_rect = layers[0][0]
+
+        return layers, bounding_rect
 
     def hoverEnterEvent(self, event: QtWidgets.QGraphicsSceneHoverEvent) -> None:
         if not self.is_class_start and not self.is_ascendancy_start:
@@ -78,16 +176,9 @@ class Node(QGraphicsItem):
         if self.get_frame_image() is None:
             return 0
 
-        frame = image_manager.get_images()['assets'][self.get_frame_image()]
-
-        y_pos = 0
-        # determine inner transparent circle of the frame for clickbox
-        while QtGui.qAlpha(frame.pixel(int(frame.width() / 2), int(frame.height() / 2 + y_pos))) < 40:
-            y_pos += 1
-
-        return y_pos * 1.3
+        return image_manager.get_frame_radius(self.get_frame_image())
     
-    def get_icon_image(self) -> QtGui.QImage:
+    def get_icon_key(self) -> Tuple[str, str]:
         # TODO: jewel slots
         category = "normal"
         if self.is_keystone:
@@ -101,11 +192,11 @@ class Node(QGraphicsItem):
             category += "Active" if self.active else "Inactive"
 
         if 'isAscendancyStart' in self.node_obj:
-            return image_manager.get_images()['assets']['AscendancyMiddle']
+            return ('assets', 'AscendancyMiddle')
 
         if 'classStartIndex' in self.node_obj:
             if not self.active:
-                return image_manager.get_images()['assets']['PSStartNodeBackgroundInactive']
+                return ('assets', 'PSStartNodeBackgroundInactive')
             
             class_lower = self.node_obj['name'].lower()
             # temp name never replaced i guess
@@ -113,28 +204,36 @@ class Node(QGraphicsItem):
                 class_lower = "scion"
             elif class_lower == "six":
                 class_lower = "shadow"
-            return image_manager.get_images()['assets'][f'center{class_lower}']
+            return ('assets', f'center{class_lower}')
 
         if not self.is_mastery:
-            return image_manager.get_images()[category][self.icon]
+            return (category, self.icon)
         else:
             if self.active:
                 category = "masteryActiveSelected"
-                return image_manager.get_images()[category][self.active_icon]
+                return (category, self.active_icon)
             elif not self.active and self.tree.is_mastery_active(self.id):
                 category = "masteryConnected"
-                return image_manager.get_images()[category][self.inactive_icon]
+                return (category, self.inactive_icon)
             else:
-                return image_manager.get_images()[category][self.inactive_icon] 
+                return (category, self.inactive_icon)
+
+    def get_icon_image(self) -> QtGui.QImage:
+        category, name = self.get_icon_key()
+
+        if category == 'assets':
+            return image_manager.get_asset_image(name)
+
+        return image_manager.get_sprite(category, name)
 
     def toggle_active(self) -> None:
         self.active = not self.active
-        self.update()
 
     def mouseReleaseEvent(self, event: QtWidgets.QGraphicsSceneMouseEvent) -> None:
         print(f"Clicked on {self.name}, id: {self.id} - outs: {self.node_obj['out']}, ins: {self.node_obj['in']}")
 
-        if self.is_class_start:
+        # nothing can be allocated until the whole tree is built, see SkillTreeView.build_tree
+        if self.is_class_start or self.tree.building:
             return
         
         if self.is_mastery:
@@ -148,42 +247,21 @@ class Node(QGraphicsItem):
             self.tree.test_unreachable(self.id)
             return
 
+        # ctrl+click collects targets that are allocated together with the next plain click
+        if event.modifiers() & QtCore.Qt.KeyboardModifier.ControlModifier:
+            self.tree.toggle_planned_target(self.id)
+            return
+
         self.tree.allocate_to(str(self.id))
 
     def get_position(self) -> Union[tuple, None]:
-        # TODO: handle clusters and passives given by jewels
-        if self.orbit_index is None or self.orbit is None:
-            return None        
-
-        if self.orbit == 2 or self.orbit == 3:
-            orbit_angles = [0, 30, 45, 60, 90, 120, 135, 150, 180, 210, 225, 240, 270, 300, 315, 330]
-            angle = orbit_angles[self.orbit_index] - 90
-        else:
-            angle = 360 / self.skills_per_orbit[self.orbit]
-            angle = angle * self.orbit_index - 90
-            
-        node_x = cos(radians(angle)) * ((self.orbit_radii[self.orbit]) * 0.3835) + self.node_group['x'] * 0.3835
-        node_y = sin(radians(angle)) * ((self.orbit_radii[self.orbit]) * 0.3835) + self.node_group['y'] * 0.3835
-
-        return (node_x, node_y)
+        return self.tree.compiled_tree.get_position(self.index)
 
     def boundingRect(self) -> QtCore.QRectF:
-        if self.get_frame_image() is not None:
-            image = image_manager.get_images()['assets'][self.get_frame_image()]
-        else:
-            image = self.get_icon_image()
-
-        if self.is_mastery and self.tree.is_mastery_active(self.id):
-            image = image_manager.get_images()['assets']['PassiveMasteryConnectedButton']
-        pos = self.position
-        if pos is not None:
-            return QtCore.QRectF(pos[0] - image.width() / 2, pos[1] - image.height() / 2, image.width(), image.height())
-        else:
-            return QtCore.QRectF(0, 0, 0, 0)
+        return self.bounding_rect
 
     def shape(self) -> QtGui.QPainterPath:
         path = QtGui.QPainterPath()
-        icon_image = self.get_icon_image()
         pos = self.position
 
         if pos is not None:
@@ -243,23 +321,10 @@ class Node(QGraphicsItem):
         return path        
 
     def paint(self, painter: QtGui.QPainter, option: QtWidgets.QStyleOptionGraphicsItem, widget: QtWidgets.QWidget) -> None:
-        icon_image = self.get_icon_image()
-        pos = self.position
-        if pos is not None:
-            if self.is_mastery and self.tree.is_mastery_active(self.id):
-                mastery_active_background = image_manager.get_images()['assets']['PassiveMasteryConnectedButton']
-                center = QtCore.QPointF(pos[0] - mastery_active_background.width() / 2, pos[1] - mastery_active_background.height() / 2)
-                painter.drawImage(center, mastery_active_background)
-
-            center = QtCore.QPointF(pos[0] - icon_image.width() / 2, pos[1] - icon_image.height() / 2)
-            painter.drawImage(center, icon_image)
-
-            frame_path = self.get_frame_image()
-
-            if frame_path is not None:
-                frame = image_manager.get_images()['assets'][frame_path]
-                center = QtCore.QPointF(pos[0] - frame.width() / 2, pos[1] - frame.height() / 2)
-                painter.drawImage(center, frame)
-
-        
-
+        scale = image_manager.get_mip_scale(option.levelOfDetailFromTransform(painter.worldTransform()))
+        for rect, key in self.layers:
+            pixmap = image_manager.get_pixmap(*key, scale)
+            if scale == 1:
+                painter.drawPixmap(rect.topLeft(), pixmap)
+            else:
+                painter.drawPixmap(rect, pixmap, QtCore.QRectF(pixmap.rect()))
@@ -1,12 +1,15 @@
+import itertools
 import math
 from PyQt5 import QtCore, QtGui, QtWidgets
 from node import Node
-from util import get_orbit_angle
+from geometry import TREE_SCALE
 from PIL import Image, ImageQt, ImageOps, ImageEnhance
 import image_manager
 
 class NodeConnection(QtWidgets.QGraphicsItem):
-    def __init__(self, first_node: Node, second_node: Node, data: dict) -> None:
+    cache_ids = itertools.count()
+
+    def __init__(self, first_node: Node, second_node: Node, data: dict, edge: int) -> None:
         super().__init__()
         self.first_node = first_node
         self.second_node = second_node
@@ -17,9 +20,8 @@ class NodeConnection(QtWidgets.QGraphicsItem):
 
         self.node_group = first_node.node_group
 
-        self.is_arc = first_node.orbit == second_node.orbit and first_node.group_id == second_node.group_id
-
-        self.last_state = "Normal"
+        # precomputed when the tree was compiled, see geometry.compute_edge_geometry
+        self.is_arc, self.angle, self.span, self.length = first_node.tree.compiled_tree.get_edge_geometry(edge)
 
         # arc path
         if self.is_arc:
@@ -28,8 +30,15 @@ class NodeConnection(QtWidgets.QGraphicsItem):
             self.image = f"LineConnector"
 
         self.image += "Active" if self.active else "Normal"
+        self.path = self.generate_path()
         self.clip_path = self.generate_clip_path()
 
+        self.cache_key = f"connection{next(NodeConnection.cache_ids)}"
+
+        self.state = self.get_state()
+        first_node.connections.append(self)
+        second_node.connections.append(self)
+
     def get_state(self) -> str:
         if self.first_node.active and self.second_node.active:
             return "Active"
@@ -40,75 +49,97 @@ class NodeConnection(QtWidgets.QGraphicsItem):
         else:
             return "Normal"
 
-    def get_connector_name(self) -> str:
+    def refresh_state(self) -> None:
+        state = self.get_state()
+        if state != self.state:
+            self.state = state
+            self.update()
+
+    def get_connector_name(self, state: str) -> str:
         if self.is_arc:
-            return f"Orbit{self.first_node.orbit}{self.get_state()}"
+            return f"Orbit{self.first_node.orbit}{state}"
         else:
-            return f"LineConnector{self.get_state()}"
+            return f"LineConnector{state}"
 
     def boundingRect(self) -> QtCore.QRectF:
         return self.clip_path.boundingRect()
 
-    def generate_clip_path(self) -> QtGui.QPainterPath:
-        first_pos = self.first_node.get_position()
-        second_pos = self.second_node.get_position()
+    def generate_path(self) -> QtGui.QPainterPath:
+        # centre line of the connection, also drawn on its own by the zoomed out overview
+        first_pos = self.first_node.position
+        second_pos = self.second_node.position
 
         connection_path = QtGui.QPainterPath(QtCore.QPointF(first_pos[0], first_pos[1]))
 
         if self.is_arc:
-            group_center = (self.node_group['x'] * 0.3835, self.node_group['y'] * 0.3835)
-
-            first_angle = get_orbit_angle(self.first_node.orbit, self.first_node.orbit_index, self.tree_data)
-            second_angle = get_orbit_angle(self.second_node.orbit, self.second_node.orbit_index, self.tree_data)
-
-            orbit_radius = self.tree_data['constants']['orbitRadii'][self.first_node.orbit] * 0.3835
-
-            span = second_angle - first_angle
-            span = (span + 180) % 360 - 180
-            span = -span
-
-            start_angle = (90 - first_angle) % 360
+            group_center = (self.node_group['x'] * TREE_SCALE, self.node_group['y'] * TREE_SCALE)
+            orbit_radius = self.tree_data['constants']['orbitRadii'][self.first_node.orbit] * TREE_SCALE
 
             arc_bounds = QtCore.QRectF(group_center[0] - orbit_radius, group_center[1] - orbit_radius, orbit_radius * 2, orbit_radius * 2)
             
-            connection_path.arcTo(arc_bounds, start_angle, span)
+            connection_path.arcTo(arc_bounds, self.angle, self.span)
         else:
             connection_path.lineTo(second_pos[0], second_pos[1])
 
+        return connection_path
+
+    def generate_clip_path(self) -> QtGui.QPainterPath:
         stroker = QtGui.QPainterPathStroker()
         stroker.setCapStyle(QtCore.Qt.FlatCap)
         stroker.setWidth(14)
-        stroke = stroker.createStroke(connection_path)
+        stroke = stroker.createStroke(self.path)
 
         return stroke
 
     def paint(self, painter: QtGui.QPainter, option: QtWidgets.QStyleOptionGraphicsItem, widget: QtWidgets.QWidget) -> None:
+        scale = image_manager.get_mip_scale(option.levelOfDetailFromTransform(painter.worldTransform()))
+        pixmap = self.get_pixmap(self.state, scale)
+
+        target = QtCore.QRectF(self.boundingRect().topLeft(), QtCore.QSizeF(pixmap.width() / scale, pixmap.height() / scale))
+        painter.drawPixmap(target, pixmap, QtCore.QRectF(pixmap.rect()))
+
+    def get_pixmap(self, state: str, scale: float) -> QtGui.QPixmap:
+        # the connection rendered once per state and scale. the cache is bounded, evicted
+        # entries are simply rendered again
+        key = f"{self.cache_key}:{state}:{scale}"
+        pixmap = QtGui.QPixmapCache.find(key)
+        if pixmap is None:
+            pixmap = self.render(state, scale)
+            QtGui.QPixmapCache.insert(key, pixmap)
+
+        return pixmap
+
+    def render(self, state: str, scale: float) -> QtGui.QPixmap:
+        rect = self.boundingRect()
+        pixmap = QtGui.QPixmap(max(1, math.ceil(rect.width() * scale)), max(1, math.ceil(rect.height() * scale)))
+        pixmap.fill(QtCore.Qt.GlobalColor.transparent)
+
+        painter = QtGui.QPainter(pixmap)
+        painter.scale(scale, scale)
+        painter.translate(-rect.left(), -rect.top())
         painter.setClipPath(self.clip_path)
         painter.setRenderHint(QtGui.QPainter.RenderHint.Antialiasing, True)    
 
-        state = self.get_state()
-        image = image_manager.get_images()['connectors'][self.get_connector_name()]
-        if self.last_state != state:
-            self.last_state = state
-            self.update()
+        name = self.get_connector_name(state)
+        image = image_manager.get_connector(name)
+        # draw a pre-scaled copy when zoomed out so the full size art is never scaled at paint time
+        connector = image_manager.get_connector_pixmap(name, scale)
 
         if self.is_arc:
-            group_center = (self.node_group['x'] * 0.3835, self.node_group['y'] * 0.3835)
+            group_center = (self.node_group['x'] * TREE_SCALE, self.node_group['y'] * TREE_SCALE)
             path_pos = QtCore.QPointF(group_center[0] - image.width() / 2, group_center[1] - image.height() / 2)
 
-            painter.drawImage(path_pos, image)
+            painter.drawPixmap(QtCore.QRectF(path_pos, QtCore.QSizeF(image.size())), connector, QtCore.QRectF(connector.rect()))
         else:                
             first_pos = self.first_node.position
-            second_pos = self.second_node.position
-            dx = second_pos[0] - first_pos[0]
-            dy = second_pos[1] - first_pos[1]
-            angle = math.atan2(dy, dx) * 180 / math.pi
-
-            distance = math.dist(first_pos, second_pos)
 
             painter.translate(first_pos[0], first_pos[1])
-            painter.rotate(angle)
-            painter.drawImage(QtCore.QPointF(0, -image.height() / 2), image)
+            painter.rotate(self.angle)
+            tile = QtCore.QSizeF(image.size())
+            painter.drawPixmap(QtCore.QRectF(QtCore.QPointF(0, -image.height() / 2), tile), connector, QtCore.QRectF(connector.rect()))
             # tile if longer than original image
-            for i in range(1, math.ceil(distance / image.width())):
-                painter.drawImage(QtCore.QPointF(image.width() * i - 2, -image.height() / 2), image)
\ No newline at end of file
+            for i in range(1, math.ceil(self.length / image.width())):
+                painter.drawPixmap(QtCore.QRectF(QtCore.QPointF(image.width() * i - 2, -image.height() / 2), tile), connector, QtCore.QRectF(connector.rect()))
+
+        painter.end()
+        return pixmap
@@ -0,0 +1,106 @@
+from array import array
+from collections import deque
+from typing import Callable, Dict, List, Tuple
+
+from tree_graph import FLAG_ASCENDANCY, FLAG_MASTERY, FLAG_ROOT, TreeGraph
+
+def get_path_rules(flags, in_ascendancy: bool) -> Tuple[Callable[[int], bool], Callable[[int], bool]]:
+    # which unallocated nodes a path may pass through and which allocated nodes it may start
+    # from. same rules as the skip criteria of TreeGraph.find_shortest_path: nodes outside the
+    # target's half of the tree are only usable when allocated, masteries never are, and
+    # unallocated root nodes are never walked through
+    if in_ascendancy:
+        def is_passable(index: int) -> bool:
+            return flags[index] & FLAG_ASCENDANCY and not flags[index] & (FLAG_MASTERY | FLAG_ROOT)
+
+        def is_source(index: int) -> bool:
+            return not flags[index] & FLAG_ASCENDANCY or not flags[index] & FLAG_MASTERY
+    else:
+        def is_passable(index: int) -> bool:
+            return not flags[index] & (FLAG_ASCENDANCY | FLAG_MASTERY | FLAG_ROOT)
+
+        def is_source(index: int) -> bool:
+            return flags[index] & FLAG_ASCENDANCY or not flags[index] & FLAG_MASTERY
+
+    return is_passable, is_source
+
+class ShortestPathForest:
+    # Multi-source BFS from every allocated node, giving each unallocated node its distance to
+    # the allocation and the next step towards it. Paths to a hovered node then become a walk
+    # along the parent pointers instead of a fresh search.
+    #
+    # find_shortest_path skips differ depending on whether the target is in the selected
+    # ascendancy, so one field is kept for main tree targets and one for ascendancy targets.
+    # Neither depends on which ascendancy is selected, only on the allocation.
+    def __init__(self, graph: TreeGraph):
+        self.graph = graph
+
+        self.version = None
+        self.fields: Dict[bool, Tuple[array, array]] = {}
+
+    def invalidate(self) -> None:
+        self.version = None
+        self.fields = {}
+
+    def get_field(self, in_ascendancy: bool, active: bytearray, version: int) -> Tuple[array, array]:
+        if self.version != version:
+            self.version = version
+            self.fields = {}
+
+        if in_ascendancy not in self.fields:
+            self.fields[in_ascendancy] = self.build_field(in_ascendancy, active)
+
+        return self.fields[in_ascendancy]
+
+    def build_field(self, in_ascendancy: bool, active: bytearray) -> Tuple[array, array]:
+        offsets = self.graph.offsets
+        neighbors = self.graph.neighbors
+        flags = self.graph.flags
+        n = len(self.graph)
+
+        is_passable, is_source = get_path_rules(flags, in_ascendancy)
+
+        dist = array('i', [-1]) * n
+        parent = array('i', [-1]) * n
+
+        q = deque()
+        for i in range(n):
+            if active[i] and is_source(i):
+                dist[i] = 0
+                q.append(i)
+
+        while len(q):
+            at = q.popleft()
+            for k in range(offsets[at], offsets[at + 1]):
+                next = neighbors[k]
+                if dist[next] != -1 or active[next] or not is_passable(next):
+                    continue
+
+                dist[next] = dist[at] + 1
+                parent[next] = at
+                q.append(next)
+
+        return dist, parent
+
+    def path_to(self, end: int, active: bytearray, ascendancy: int, version: int) -> List[int]:
+        # returns [end, ..., allocated node] like TreeGraph.find_shortest_path
+        end_in_ascendant = self.graph.node_ascendancy[end] != -1 and self.graph.node_ascendancy[end] == ascendancy
+        dist, parent = self.get_field(end_in_ascendant, active, version)
+
+        best = -1
+        for neighbor in self.graph.neighbors_of(end):
+            if neighbor == end or dist[neighbor] == -1:
+                continue
+
+            if best == -1 or dist[neighbor] < dist[best]:
+                best = neighbor
+
+        if best == -1:
+            return []
+
+        path = [end, best]
+        while dist[best] > 0:
+            best = parent[best]
+            path.append(best)
+
+        return path
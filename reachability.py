@@ -0,0 +1,114 @@
+from collections import deque
+from typing import Dict, List
+
+from tree_graph import FLAG_MASTERY, FLAG_ROOT, TreeGraph
+
+class ReachabilityEngine:
+    # Answers "which allocated nodes are no longer connected to the class root" with the same
+    # rules as SkillTreeView.is_reachable: masteries and unallocated nodes are never traversed
+    # and root nodes are never reported.
+    def __init__(self, graph: TreeGraph):
+        self.graph = graph
+
+        self.cached_key = None
+        self.order = []
+        self.disc = []
+        self.size = []
+        self.cuts = {}
+        self.unreached = []
+
+    def invalidate(self) -> None:
+        self.cached_key = None
+
+    def find_orphans(self, root: int, active: bytearray) -> List[int]:
+        offsets = self.graph.offsets
+        neighbors = self.graph.neighbors
+        flags = self.graph.flags
+
+        reached = bytearray(len(self.graph))
+        reached[root] = 1
+        q = deque([root])
+        while len(q):
+            at = q.popleft()
+            for k in range(offsets[at], offsets[at + 1]):
+                next = neighbors[k]
+                if reached[next] or not active[next] or flags[next] & FLAG_MASTERY:
+                    continue
+
+                reached[next] = 1
+                q.append(next)
+
+        return [i for i in range(len(reached)) if active[i] and not reached[i] and not flags[i] & FLAG_ROOT]
+
+    def orphans_if_removed(self, root: int, removed: int, active: bytearray, version: int) -> List[int]:
+        # nodes that become unreachable once `removed` is deallocated, answered from the
+        # cut vertices of the current allocation without another traversal
+        self.update(root, active, version)
+
+        flags = self.graph.flags
+        orphans = [i for i in self.unreached if i != removed]
+
+        if removed == root or self.disc[removed] == -1:
+            return orphans
+
+        for child in self.cuts.get(removed, []):
+            start = self.disc[child]
+            for i in self.order[start:start + self.size[child]]:
+                if not flags[i] & FLAG_ROOT:
+                    orphans.append(i)
+
+        return orphans
+
+    def update(self, root: int, active: bytearray, version: int) -> None:
+        if self.cached_key == (root, version):
+            return
+
+        offsets = self.graph.offsets
+        neighbors = self.graph.neighbors
+        flags = self.graph.flags
+        n = len(self.graph)
+
+        # iterative DFS over the allocated subgraph recording discovery order, low-links and
+        # subtree sizes; the subtree of child c is cut off by removing v when low[c] >= disc[v]
+        disc = [-1] * n
+        low = [0] * n
+        size = [1] * n
+        parent = [-1] * n
+        order = [root]
+        cuts: Dict[int, List[int]] = {}
+
+        disc[root] = 0
+        stack = [[root, offsets[root]]]
+        while len(stack):
+            frame = stack[-1]
+            at = frame[0]
+            if frame[1] < offsets[at + 1]:
+                next = neighbors[frame[1]]
+                frame[1] += 1
+
+                if next != root and (not active[next] or flags[next] & FLAG_MASTERY):
+                    continue
+
+                if disc[next] == -1:
+                    parent[next] = at
+                    disc[next] = low[next] = len(order)
+                    order.append(next)
+                    stack.append([next, offsets[next]])
+                elif next != parent[at]:
+                    low[at] = min(low[at], disc[next])
+                continue
+
+            stack.pop()
+            if len(stack):
+                up = stack[-1][0]
+                low[up] = min(low[up], low[at])
+                size[up] += size[at]
+                if up != root and low[at] >= disc[up]:
+                    cuts.setdefault(up, []).append(at)
+
+        self.order = order
+        self.disc = disc
+        self.size = size
+        self.cuts = cuts
+        self.unreached = [i for i in range(n) if active[i] and disc[i] == -1 and not flags[i] & FLAG_ROOT]
+        self.cached_key = (root, version)
@@ -0,0 +1,77 @@
+import mmap
+import os
+import struct
+from typing import Dict, List, Tuple, Union
+
+# on disk format for split sprite sheets and other generated images: an entry table followed by
+# raw RGBA8888 pixels, so images load straight into a QImage without going through PIL.
+# kept free of Qt so asset_pipeline workers can write it
+
+SPRITE_CACHE_DIR = "cache/sprites"
+SPRITE_CACHE_MAGIC = b'POESPR\0\0'
+SPRITE_CACHE_VERSION = 1
+# magic, version, sprite count
+SPRITE_CACHE_HEADER = struct.Struct('<8sII')
+# width, height, name length, pixel offset
+SPRITE_CACHE_ENTRY = struct.Struct('<HHIQ')
+
+def get_sprite_cache_path(sheet_type: str, filename: str, ver: str) -> str:
+    return f"{SPRITE_CACHE_DIR}/{sheet_type}_{filename}_{ver}.bin"
+
+def write_sprite_cache(path: str, sprites: List[Tuple[str, int, int, bytes]]) -> None:
+    # written in pieces rather than concatenated, large caches like the background tiles hold hundreds of images
+    entries = []
+    pixels = []
+    pixel_offset = 0
+    for name, width, height, rgba in sprites:
+        encoded_name = name.encode()
+        entries.append(SPRITE_CACHE_ENTRY.pack(width, height, len(encoded_name), pixel_offset) + encoded_name)
+        pixels.append(rgba)
+        pixel_offset += len(rgba)
+
+    header = SPRITE_CACHE_HEADER.pack(SPRITE_CACHE_MAGIC, SPRITE_CACHE_VERSION, len(sprites))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # write then rename so a crash or a concurrent reader never sees half a file
+    with open(path + '.tmp', 'wb') as f:
+        f.write(header)
+        f.write(b''.join(entries))
+        for rgba in pixels:
+            f.write(rgba)
+    os.replace(path + '.tmp', path)
+
+def open_sprite_cache(path: str) -> Union[Tuple[mmap.mmap, Dict[str, Tuple[int, int, int]]], None]:
+    # returns the mapped file and name -> (width, height, pixel start), or None if missing or stale
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < SPRITE_CACHE_HEADER.size:
+            return None
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, count = SPRITE_CACHE_HEADER.unpack_from(buffer)
+    if magic != SPRITE_CACHE_MAGIC or version != SPRITE_CACHE_VERSION:
+        return None
+
+    # a truncated or corrupt file is a cache miss like a stale one, the sheet is split again
+    offset = SPRITE_CACHE_HEADER.size
+    entries = []
+    try:
+        for _ in range(count):
+            width, height, name_length, pixel_offset = SPRITE_CACHE_ENTRY.unpack_from(buffer, offset)
+            offset += SPRITE_CACHE_ENTRY.size
+            if offset + name_length > len(buffer):
+                return None
+            entries.append((buffer[offset:offset + name_length].decode(), width, height, pixel_offset))
+            offset += name_length
+    except (struct.error, UnicodeDecodeError):
+        return None
+
+    sprites = {}
+    for name, width, height, pixel_offset in entries:
+        if offset + pixel_offset + width * height * 4 > len(buffer):
+            return None
+        sprites[name] = (width, height, offset + pixel_offset)
+
+    return buffer, sprites
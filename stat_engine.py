@@ -0,0 +1,111 @@
+from array import array
+from typing import Dict, List, Tuple
+
+from stat_text import get_stat_lines, parse_stat_line
+from tree_graph import TreeGraph
+
+# totals closer to zero than this are leftovers of adding and removing the same values
+EPSILON = 1e-9
+
+class StatTable:
+    # Every stats line of the tree parsed once into numeric modifiers. A stat kind is a line
+    # with its numbers replaced by # and which of those numbers it is, so "+10 to Strength" and
+    # "+5 to Strength" add to the same kind. Lines without numbers count as 1.
+    #
+    # Rows are stored like TreeGraph's neighbours: row i's modifiers are kinds[k] and values[k]
+    # for k in offsets[i]:offsets[i + 1]. Node i is row i, mastery effects come after the nodes.
+    def __init__(self, graph: TreeGraph, data: dict):
+        self.stat_kinds: List[Tuple[str, int]] = []
+        self.kind_index: Dict[Tuple[str, int], int] = {}
+
+        self.offsets = array('i', [0])
+        self.kinds = array('i')
+        self.values = array('d')
+
+        nodes = data['nodes']
+        for i in range(len(graph)):
+            self.add_row(nodes[graph.id_of(i)].get('stats', []))
+
+        # mastery effect id -> its row
+        self.effect_rows: Dict[int, int] = {}
+        for node_id in graph.ids:
+            for effect in nodes[node_id].get('masteryEffects', []):
+                if effect['effect'] not in self.effect_rows:
+                    self.effect_rows[effect['effect']] = self.add_row(effect['stats'])
+
+    def add_row(self, stats: List[str]) -> int:
+        for line in get_stat_lines(stats):
+            template, values = parse_stat_line(line)
+            for slot, value in enumerate(values or [1.0]):
+                key = (template, slot)
+                if key not in self.kind_index:
+                    self.kind_index[key] = len(self.stat_kinds)
+                    self.stat_kinds.append(key)
+
+                self.kinds.append(self.kind_index[key])
+                self.values.append(value)
+
+        self.offsets.append(len(self.kinds))
+        return len(self.offsets) - 2
+
+    def compute_totals(self, active: bytearray, mastery_effects: Dict[int, int]) -> array:
+        # totals of any allocation from scratch, mastery_effects maps mastery node index to effect id
+        totals = array('d', [0.0]) * len(self.stat_kinds)
+        rows = [i for i in range(len(active)) if active[i]]
+        rows += [self.effect_rows[effect] for index, effect in mastery_effects.items() if active[index] and effect in self.effect_rows]
+
+        offsets = self.offsets
+        kinds = self.kinds
+        values = self.values
+        for row in rows:
+            for k in range(offsets[row], offsets[row + 1]):
+                totals[kinds[k]] += values[k]
+
+        return totals
+
+    def format_totals(self, totals: array) -> List[str]:
+        # the stat lines of every template with a nonzero total, numbers filled in again
+        templates: Dict[str, Dict[int, float]] = {}
+        for kind, total in enumerate(totals):
+            if abs(total) > EPSILON:
+                template, slot = self.stat_kinds[kind]
+                templates.setdefault(template, {})[slot] = total
+
+        lines = []
+        for template, slots in templates.items():
+            if '#' not in template:
+                lines.append(template if slots[0] == 1 else f"{template} (x{slots[0]:g})")
+                continue
+
+            parts = template.split('#')
+            line = parts[0]
+            for slot, part in enumerate(parts[1:]):
+                line += f"{round(slots.get(slot, 0.0), 6):g}" + part
+            lines.append(line)
+
+        return sorted(lines)
+
+class StatTotals:
+    # stat totals of the allocation, kept up to date one node at a time like AllocationStats
+    def __init__(self, table: StatTable):
+        self.table = table
+        self.totals = array('d', [0.0]) * len(table.stat_kinds)
+
+    def change(self, row: int, delta: int) -> None:
+        # delta is 1 when the row was added to the build and -1 when it was removed
+        table = self.table
+        totals = self.totals
+        for k in range(table.offsets[row], table.offsets[row + 1]):
+            totals[table.kinds[k]] += delta * table.values[k]
+
+    def change_effect(self, effect: int, delta: int) -> None:
+        row = self.table.effect_rows.get(effect)
+        if row is not None:
+            self.change(row, delta)
+
+    def get(self, template: str, slot: int = 0) -> float:
+        kind = self.table.kind_index.get((template, slot))
+        return self.totals[kind] if kind is not None else 0.0
+
+    def format(self) -> List[str]:
+        return self.table.format_totals(self.totals)
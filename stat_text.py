@@ -0,0 +1,42 @@
+import re
+from typing import Dict, Iterable, List, Tuple
+
+NUMBER = re.compile(r'\d+(?:\.\d+)?')
+
+def get_stat_lines(stats: Iterable[str]) -> List[str]:
+    # a stats entry can hold several lines
+    return [line for stat in stats for line in stat.split('\n') if line]
+
+def parse_stat_line(line: str) -> Tuple[str, List[float]]:
+    # "10% increased maximum Life" -> ("#% increased maximum Life", [10.0]). signs stay part of
+    # the text, "+5 to Strength" -> ("+# to Strength", [5.0])
+    return NUMBER.sub('#', line), [float(value) for value in NUMBER.findall(line)]
+
+def parse_stat_weights(text: str) -> Dict[str, float]:
+    # "maximum life=0.02; mana=0.01" -> {"maximum life": 0.02, "mana": 0.01}, names are
+    # matched case insensitively against stat lines, see get_stat_benefit
+    weights = {}
+    for entry in text.split(';'):
+        if not entry.strip():
+            continue
+
+        name, separator, value = entry.rpartition('=')
+        if not separator or not name.strip():
+            raise ValueError(f"Expected stat=weight, got {entry.strip()}")
+
+        weights[name.strip().lower()] = float(value)
+
+    return weights
+
+def get_stat_benefit(stats: Iterable[str], weights: Dict[str, float]) -> float:
+    # every line containing a weighted name adds the weight times its first number, or just
+    # the weight if it has none
+    benefit = 0.0
+    for line in get_stat_lines(stats):
+        lowered = line.lower()
+        for name, weight in weights.items():
+            if name in lowered:
+                _, values = parse_stat_line(line)
+                benefit += weight * (values[0] if values else 1.0)
+
+    return benefit
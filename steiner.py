@@ -0,0 +1,204 @@
+from array import array
+from typing import Dict, Iterable, List, Optional, Set
+
+from tree_graph import FLAG_ASCENDANCY, FLAG_MASTERY, FLAG_ROOT, TreeGraph
+
+# target counts up to this are solved exactly, the exact solver grows with 3^targets. plans are
+# previewed on hover, so this is kept low enough for that to stay responsive
+EXACT_TARGET_LIMIT = 3
+
+INF = 1 << 30
+# weights of nodes that can't be walked through
+BLOCKED = -1
+
+class SteinerPlanner:
+    # Finds the fewest unallocated nodes that connect a set of targets to the allocation, so
+    # paths to several targets are shared instead of each taking its own shortest path. Small
+    # target sets are solved exactly with the Dreyfus-Wagner dynamic program, with the
+    # allocation as one more terminal. Larger ones grow the allocation towards the nearest
+    # remaining target until all are connected, which is within a factor of two of the best.
+    #
+    # Nodes cost one point unless allocated. The rules are those of
+    # TreeGraph.find_shortest_path: masteries and unallocated roots are never walked through
+    # and ascendancy nodes only when they belong to the selected ascendancy.
+    def __init__(self, graph: TreeGraph):
+        self.graph = graph
+
+    def get_weights(self, active: bytearray, ascendancy: int) -> array:
+        flags = self.graph.flags
+        node_ascendancy = self.graph.node_ascendancy
+
+        weights = array('b', [BLOCKED]) * len(self.graph)
+        for i in range(len(self.graph)):
+            if flags[i] & FLAG_MASTERY:
+                continue
+            if active[i]:
+                weights[i] = 0
+            elif not flags[i] & FLAG_ROOT and (not flags[i] & FLAG_ASCENDANCY or node_ascendancy[i] == ascendancy):
+                weights[i] = 1
+
+        return weights
+
+    def plan(self, targets: Iterable[int], active: bytearray, ascendancy: int) -> List[int]:
+        # the unallocated nodes to allocate, targets included. raises ValueError if a target
+        # can't be connected
+        targets = sorted({target for target in targets if not active[target]})
+        if not targets:
+            return []
+
+        weights = self.get_weights(active, ascendancy)
+        if len(targets) <= EXACT_TARGET_LIMIT:
+            nodes = self.solve_exact(targets, active, weights)
+        else:
+            nodes = self.solve_greedy(targets, active, weights)
+
+        return sorted(index for index in nodes if not active[index])
+
+    def relax(self, cost: List[int], parent: array, weights: array, ends: Set[int] = frozenset(), allowed: Optional[bytearray] = None) -> None:
+        # dijkstra from every node with a finite cost, only over allowed nodes if given. blocked
+        # nodes are only entered when they are in ends and never left unless they were a
+        # starting point. weights are 0 or 1, so a bucket per cost replaces the heap
+        offsets = self.graph.offsets
+        neighbors = self.graph.neighbors
+
+        buckets: List[List[int]] = []
+        for i, c in enumerate(cost):
+            if c < INF:
+                while len(buckets) <= c:
+                    buckets.append([])
+                buckets[c].append(i)
+
+        c = 0
+        while c < len(buckets):
+            # zero weight steps append to the bucket being walked, which the loop picks up
+            for at in buckets[c]:
+                if cost[at] != c or (weights[at] == BLOCKED and parent[at] != -1):
+                    continue
+
+                for k in range(offsets[at], offsets[at + 1]):
+                    next = neighbors[k]
+                    if allowed is not None and not allowed[next]:
+                        continue
+
+                    weight = weights[next]
+                    if weight == BLOCKED:
+                        if next not in ends:
+                            continue
+                        weight = 1
+
+                    if c + weight < cost[next]:
+                        cost[next] = c + weight
+                        parent[next] = at
+                        if c + weight == len(buckets):
+                            buckets.append([])
+                        buckets[c + weight].append(next)
+            c += 1
+
+    def solve_greedy(self, targets: List[int], active: bytearray, weights: array) -> Set[int]:
+        n = len(self.graph)
+        tree = set(i for i in range(n) if weights[i] == 0)
+        remaining = set(targets)
+
+        while remaining:
+            cost = [0 if i in tree and weights[i] != BLOCKED else INF for i in range(n)]
+            parent = array('i', [-1]) * n
+            self.relax(cost, parent, weights, remaining)
+
+            target = min(remaining, key=lambda i: cost[i])
+            if cost[target] >= INF:
+                raise ValueError(f"Node {self.graph.id_of(target)} can't be connected to the allocation")
+
+            # the path joins the tree, later targets can branch off anywhere along it
+            at = target
+            while at != -1 and at not in tree:
+                tree.add(at)
+                at = parent[at]
+            remaining.discard(target)
+
+        return tree
+
+    def solve_exact(self, targets: List[int], active: bytearray, weights: array) -> Set[int]:
+        n = len(self.graph)
+        # terminal k is the allocation itself
+        k = len(targets)
+        full = (1 << (k + 1)) - 1
+        node_cost = [1 - active[i] for i in range(n)]
+
+        # cost[mask][v]: cheapest tree spanning the terminals in mask and v, v included. split
+        # and parent record how it was built so the nodes can be collected again
+        cost: Dict[int, List[int]] = {}
+        split: Dict[int, Dict[int, int]] = {}
+        parent: Dict[int, array] = {}
+
+        allocation = [i for i in range(n) if weights[i] == 0]
+        for terminal in range(k + 1):
+            mask = 1 << terminal
+            cost[mask] = [INF] * n
+            split[mask] = {}
+            parent[mask] = array('i', [-1]) * n
+            if terminal < k:
+                cost[mask][targets[terminal]] = 1
+            else:
+                for i in allocation:
+                    cost[mask][i] = 0
+            self.relax(cost[mask], parent[mask], weights)
+
+        for terminal in range(k):
+            if all(cost[1 << terminal][i] >= INF for i in allocation):
+                raise ValueError(f"Node {self.graph.id_of(targets[terminal])} can't be connected to the allocation")
+
+        # a node of the best tree lies on it between the allocation and some target, so the
+        # greedy plan bounds which nodes the larger terminal sets have to look at
+        bound = sum(node_cost[i] for i in self.solve_greedy(targets, active, weights))
+        to_allocation = cost[1 << k]
+        allowed = bytearray(n)
+        candidates = []
+        for v in range(n):
+            if to_allocation[v] + min(cost[1 << terminal][v] for terminal in range(k)) - node_cost[v] <= bound:
+                allowed[v] = 1
+                candidates.append(v)
+
+        for mask in range(1, full + 1):
+            if mask & (mask - 1) == 0:
+                continue
+
+            best = cost[mask] = [INF] * n
+            choices = split[mask] = {}
+            parent[mask] = array('i', [-1]) * n
+
+            # every way of splitting mask in two, counting each split once
+            low = mask & -mask
+            sub = (mask - 1) & mask
+            while sub:
+                if sub & low:
+                    first = cost[sub]
+                    second = cost[mask ^ sub]
+                    for v in candidates:
+                        c = first[v] + second[v] - node_cost[v]
+                        if c < best[v]:
+                            best[v] = c
+                            choices[v] = sub
+                sub = (sub - 1) & mask
+
+            merged = list(best)
+            self.relax(best, parent[mask], weights, allowed=allowed)
+            # nodes reached by a path aren't a split any more
+            for v in candidates:
+                if best[v] < merged[v]:
+                    choices.pop(v, None)
+
+        answer = cost[full]
+        end = min(candidates, key=answer.__getitem__)
+
+        nodes = set()
+        stack = [(full, end)]
+        while stack:
+            mask, v = stack.pop()
+            nodes.add(v)
+            if v in split[mask]:
+                stack.append((split[mask][v], v))
+                stack.append((mask ^ split[mask][v], v))
+            elif parent[mask][v] != -1:
+                stack.append((mask, parent[mask][v]))
+
+        return nodes
@@ -0,0 +1,185 @@
+import hashlib
+import marshal
+import mmap
+import os
+import struct
+import sys
+from array import array
+from time import perf_counter
+from typing import Dict, Optional, Tuple
+
+import geometry
+from tree_graph import TreeGraph
+from stat_engine import StatTable
+from tree_index import TreeIndex
+
+CACHE_VERSION = 2
+MAGIC = b'POETREE\0'
+
+# magic, cache version, platform tag, sha256 of the source file, number of sections
+HEADER = struct.Struct('<8sI32s32sI')
+# name, offset, length
+SECTION = struct.Struct('<8sQQ')
+
+def get_platform_tag() -> bytes:
+    # arrays are stored in native byte order and the tree data with marshal, both of which
+    # are only valid for the interpreter that wrote them
+    return f"{sys.byteorder}-{sys.implementation.cache_tag}-{marshal.version}".encode()[:32]
+
+def get_source_hash(source: str) -> bytes:
+    with open(source, 'rb') as f:
+        return hashlib.sha256(f.read()).digest()
+
+class CompiledTree:
+    def __init__(self, data: dict, sections: Dict[str, memoryview], source_hash: bytes):
+        self.data = data
+        self.source_hash = source_hash
+
+        self.node_ids = bytes(sections['nodeids']).decode().split('\0')
+        self.ascendancies = [name for name in bytes(sections['ascnames']).decode().split('\0') if name]
+        self.group_ids = bytes(sections['groupids']).decode().split('\0')
+
+        self.flags = sections['flags'].cast('H')
+        self.node_ascendancy = sections['nodeasc'].cast('b')
+        self.offsets = sections['offsets'].cast('i')
+        self.neighbors = sections['nbrs'].cast('i')
+        self.positions = sections['pos'].cast('d')
+        self.angles = sections['nodeang'].cast('d')
+        self.node_group = sections['nodegrp'].cast('i')
+
+        self.group_x = sections['groupx'].cast('d')
+        self.group_y = sections['groupy'].cast('d')
+        self.group_orbits = sections['orbits'].cast('H')
+
+        # connections, see geometry.compute_edge_geometry
+        self.edge_nodes = sections['edges'].cast('i')
+        self.edge_arc = sections['edgearc'].cast('b')
+        self.edge_angle = sections['edgeang'].cast('d')
+        self.edge_span = sections['edgespan'].cast('d')
+        self.edge_length = sections['edgelen'].cast('d')
+
+        self.graph = TreeGraph.from_arrays(self.node_ids, self.flags, self.node_ascendancy, self.ascendancies, self.offsets, self.neighbors)
+        self.index = TreeIndex(self.graph, self.node_group, len(self.group_ids), data)
+        self.stat_table = StatTable(self.graph, data)
+
+    def get_position(self, index: int) -> Optional[Tuple[float, float]]:
+        x = self.positions[index * 2]
+        if x != x:
+            return None
+
+        return (x, self.positions[index * 2 + 1])
+
+    def get_edge_count(self) -> int:
+        return len(self.edge_arc)
+
+    def get_edge_nodes(self, edge: int) -> Tuple[int, int]:
+        return self.edge_nodes[edge * 2], self.edge_nodes[edge * 2 + 1]
+
+    def get_edge_geometry(self, edge: int) -> Tuple[bool, float, float, float]:
+        # whether the edge is an arc, its angle, its span and its length
+        return bool(self.edge_arc[edge]), self.edge_angle[edge], self.edge_span[edge], self.edge_length[edge]
+
+def compile_tree(source: str = 'data.json', target: str = 'cache/tree.bin') -> None:
+    import json
+
+    with open(source, 'rb') as f:
+        raw = f.read()
+    data = json.loads(raw)
+
+    graph = TreeGraph(data)
+    group_ids = list(data['groups'])
+    group_index = {group_id: i for i, group_id in enumerate(group_ids)}
+
+    positions, angles = geometry.compute_node_geometry(graph.ids, data)
+    edges = geometry.compute_edge_geometry(geometry.get_connection_pairs(data), graph.index, positions, angles, data)
+
+    node_group = array('i')
+    for node_id in graph.ids:
+        node_group.append(group_index.get(str(data['nodes'][node_id].get('group')), -1))
+
+    group_x = array('d', [data['groups'][group_id]['x'] for group_id in group_ids])
+    group_y = array('d', [data['groups'][group_id]['y'] for group_id in group_ids])
+    group_orbits = array('H', [sum(1 << orbit for orbit in set(data['groups'][group_id]['orbits'])) for group_id in group_ids])
+
+    sections = [
+        (b'nodeids', '\0'.join(graph.ids).encode()),
+        (b'ascnames', '\0'.join(graph.ascendancies).encode()),
+        (b'groupids', '\0'.join(group_ids).encode()),
+        (b'flags', graph.flags.tobytes()),
+        (b'nodeasc', graph.node_ascendancy.tobytes()),
+        (b'offsets', graph.offsets.tobytes()),
+        (b'nbrs', graph.neighbors.tobytes()),
+        (b'pos', positions.tobytes()),
+        (b'nodeang', angles.tobytes()),
+        (b'nodegrp', node_group.tobytes()),
+        (b'groupx', group_x.tobytes()),
+        (b'groupy', group_y.tobytes()),
+        (b'orbits', group_orbits.tobytes()),
+        *((name.encode(), values.tobytes()) for name, values in edges.items()),
+        (b'data', marshal.dumps(data)),
+    ]
+
+    header = HEADER.pack(MAGIC, CACHE_VERSION, get_platform_tag(), hashlib.sha256(raw).digest(), len(sections))
+    offset = HEADER.size + SECTION.size * len(sections)
+    table = b''
+    body = b''
+    for name, blob in sections:
+        # keep every section 8 byte aligned so the arrays can be cast in place
+        padding = -(offset + len(body)) % 8
+        body += b'\0' * padding
+        table += SECTION.pack(name, offset + len(body), len(blob))
+        body += blob
+
+    os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+    with open(target + '.tmp', 'wb') as f:
+        f.write(header + table + body)
+    os.replace(target + '.tmp', target)
+
+def read_tree(target: str, source_hash: Optional[bytes] = None) -> Optional[CompiledTree]:
+    if not os.path.exists(target):
+        return None
+
+    with open(target, 'rb') as f:
+        # an empty file can't be mapped, it is left behind by e.g. a full disk
+        if os.fstat(f.fileno()).st_size < HEADER.size:
+            return None
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    view = memoryview(buffer)
+
+    magic, version, platform_tag, cached_hash, count = HEADER.unpack_from(view)
+    if (magic != MAGIC or version != CACHE_VERSION or platform_tag != get_platform_tag().ljust(32, b'\0')
+        or (source_hash is not None and cached_hash != source_hash)):
+        return None
+
+    # a truncated file is a cache miss like a stale one, it is compiled again
+    if HEADER.size + SECTION.size * count > len(view):
+        return None
+
+    sections = {}
+    for i in range(count):
+        name, offset, length = SECTION.unpack_from(view, HEADER.size + SECTION.size * i)
+        if offset + length > len(view):
+            return None
+        sections[name.rstrip(b'\0').decode()] = view[offset:offset + length]
+
+    try:
+        data = marshal.loads(sections['data'])
+        return CompiledTree(data, sections, cached_hash)
+    except (KeyError, ValueError, TypeError, EOFError):
+        return None
+
+def load_tree(source: str = 'data.json', target: str = 'cache/tree.bin') -> CompiledTree:
+    start = perf_counter()
+
+    source_hash = get_source_hash(source) if os.path.exists(source) else None
+    tree = read_tree(target, source_hash)
+    if tree is None:
+        compile_tree(source, target)
+        tree = read_tree(target, source_hash)
+
+    print(f"Loaded tree data in {perf_counter() - start} seconds")
+    return tree
+
+if __name__ == '__main__':
+    compile_tree(*sys.argv[1:3])
@@ -0,0 +1,301 @@
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from allocation import AllocationHistory, AllocationStats, AllocationTransaction
+from build_code import DecodedBuild, encode_tree_url, get_ascendancy_index, get_ascendancy_name
+from path_forest import ShortestPathForest
+from reachability import ReachabilityEngine
+from stat_engine import StatTotals
+from steiner import SteinerPlanner
+from tree_cache import CompiledTree
+from tree_graph import FLAG_ASCENDANCY_START, FLAG_MASTERY, FLAG_MULTIPLE_CHOICE_OPTION, FLAG_ROOT
+from weighted_path import WeightedPathfinder
+
+class TreeEngine:
+    # allocation state and the pathing, reachability and point counting rules of the tree,
+    # without Qt. SkillTreeView drives one of these and mirrors its state into the scene,
+    # scripts and the build evaluator use it directly
+    def __init__(self, tree: CompiledTree):
+        self.tree = tree
+        self.graph = tree.graph
+        self.index = tree.index
+
+        self.allocated = bytearray(len(self.graph))
+        self.allocation_version = 0
+        self.stats = AllocationStats(self.graph)
+        self.stat_totals = StatTotals(tree.stat_table)
+        self.history = AllocationHistory()
+        self.reachability = ReachabilityEngine(self.graph)
+        self.path_forest = ShortestPathForest(self.graph)
+        # paths from orphans to the connected part of an evaluated build, see evaluate
+        self.orphan_forest = ShortestPathForest(self.graph)
+        self.planner = SteinerPlanner(self.graph)
+        self.weighted_path = WeightedPathfinder(tree)
+
+        self.class_index = 0
+        self.ascendancy = None
+        # mastery node index -> selected effect id
+        self.mastery_effects: Dict[int, int] = {}
+
+    def get_class_root(self) -> int:
+        return self.index.class_starts[self.class_index]
+
+    def set_allocated(self, index: int, active: bool) -> None:
+        if self.allocated[index] != active:
+            self.allocated[index] = active
+            self.allocation_version += 1
+            self.stats.change(index, 1 if active else -1)
+            self.stat_totals.change(index, 1 if active else -1)
+            if index in self.mastery_effects:
+                self.stat_totals.change_effect(self.mastery_effects[index], 1 if active else -1)
+            self.history.record(index)
+
+    def set_mastery_effect(self, index: int, effect: Optional[int]) -> None:
+        # selects a mastery's effect, None clears it. only allocated masteries add to the totals
+        previous = self.mastery_effects.pop(index, None)
+        if previous is not None and self.allocated[index]:
+            self.stat_totals.change_effect(previous, -1)
+
+        if effect is not None:
+            self.mastery_effects[index] = effect
+            if self.allocated[index]:
+                self.stat_totals.change_effect(effect, 1)
+
+    def set_mastery_effects(self, masteries: Dict[int, int]) -> None:
+        for index in list(self.mastery_effects):
+            self.set_mastery_effect(index, None)
+        for index, effect in masteries.items():
+            self.set_mastery_effect(index, effect)
+
+    def reset(self, class_index: int, ascendancy: Optional[str] = None) -> None:
+        # an empty build: only the class start and the ascendancy start are allocated. evaluate
+        # goes through here too, so a bad class from its input is rejected before anything changes
+        if not 0 <= class_index < len(self.index.class_starts):
+            raise ValueError(f"Class index {class_index} is out of range")
+
+        for index in [i for i, active in enumerate(self.allocated) if active]:
+            self.set_allocated(index, False)
+
+        self.class_index = class_index
+        self.ascendancy = ascendancy
+        self.set_allocated(self.get_class_root(), True)
+        if ascendancy is not None:
+            self.set_allocated(self.index.ascendancy_starts[ascendancy], True)
+
+        self.set_mastery_effects({})
+        self.history.clear()
+
+    def build_allocation(self, build: DecodedBuild) -> Tuple[bytearray, Dict[int, int]]:
+        # the allocation and mastery selections a decoded tree code describes. node ids that
+        # aren't on this tree, e.g. from another tree version, are skipped
+        graph = self.graph
+        allocated = bytearray(len(graph))
+        allocated[self.index.class_starts[build.class_index]] = True
+
+        ascendancy = get_ascendancy_name(self.tree.data, build.class_index, build.ascendancy_index)
+        if ascendancy is not None:
+            allocated[self.index.ascendancy_starts[ascendancy]] = True
+
+        for node_id in build.nodes:
+            index = graph.index.get(str(node_id))
+            if index is not None:
+                allocated[index] = True
+
+        masteries = {}
+        for node_id, effect in build.masteries.items():
+            index = graph.index.get(str(node_id))
+            if index is not None and allocated[index]:
+                masteries[index] = effect
+
+        return allocated, masteries
+
+    def load_build(self, build: DecodedBuild) -> None:
+        allocated, masteries = self.build_allocation(build)
+
+        self.reset(build.class_index, get_ascendancy_name(self.tree.data, build.class_index, build.ascendancy_index))
+        for index in [i for i, active in enumerate(allocated) if active]:
+            self.set_allocated(index, True)
+        self.set_mastery_effects(masteries)
+
+        self.history.clear()
+
+    def export_build(self) -> str:
+        # class and ascendancy starts are implied by the class and ascendancy, cluster jewel
+        # nodes aren't supported yet
+        graph = self.graph
+        nodes = [int(graph.id_of(i)) for i, active in enumerate(self.allocated)
+                 if active and not graph.has_flag(i, FLAG_ROOT | FLAG_ASCENDANCY_START)]
+        masteries = {int(graph.id_of(index)): effect for index, effect in self.mastery_effects.items() if self.allocated[index]}
+
+        return encode_tree_url(self.class_index, get_ascendancy_index(self.tree.data, self.class_index, self.ascendancy), nodes, masteries)
+
+    def plan_allocation(self, transaction: AllocationTransaction) -> Dict[int, bool]:
+        # validates the whole transaction against the allocation it would result in and returns
+        # the new state of every node it changes. nodes cut off from the class start by the
+        # removals are deallocated too. raises ValueError if the additions pick exclusive
+        # multiple choice options or aren't connected to the class start
+        graph = self.graph
+        proposed = bytearray(self.allocated)
+        changed = set()
+
+        for node_id in transaction.removals:
+            index = graph.index_of(node_id)
+            proposed[index] = False
+            changed.add(index)
+
+        added = set()
+        for node_id in transaction.additions:
+            index = graph.index_of(node_id)
+            if graph.has_flag(index, FLAG_MULTIPLE_CHOICE_OPTION):
+                for sibling in self.index.choice_options.get(index, []):
+                    if sibling == index:
+                        continue
+                    if graph.id_of(sibling) in transaction.additions:
+                        raise ValueError(f"Multiple choice options {node_id} and {graph.id_of(sibling)} can't both be allocated")
+
+                    proposed[sibling] = False
+                    changed.add(sibling)
+
+            proposed[index] = True
+            added.add(index)
+            changed.add(index)
+
+        class_root = self.get_class_root()
+        if len(transaction.removals) == 1 and not transaction.additions:
+            # a single click deallocation, answered from the cached cut vertices
+            orphans = self.reachability.orphans_if_removed(class_root, next(iter(changed)), self.allocated, self.allocation_version)
+        else:
+            orphans = self.reachability.find_orphans(class_root, proposed)
+
+        for index in self.drop_orphans(orphans, proposed):
+            changed.add(index)
+
+        unreachable = [graph.id_of(index) for index in added if not proposed[index]]
+        if len(unreachable):
+            raise ValueError(f"Nodes {', '.join(sorted(unreachable))} aren't connected to the class start")
+
+        return {index: bool(proposed[index]) for index in changed if proposed[index] != self.allocated[index]}
+
+    def drop_orphans(self, orphans: List[int], active: bytearray) -> List[int]:
+        # deallocates orphans in active and returns them. masteries are never walked through,
+        # they stay allocated as long as a neighbour is
+        dropped = []
+        for index in orphans:
+            if not self.graph.has_flag(index, FLAG_MASTERY):
+                active[index] = False
+                dropped.append(index)
+
+        for index in orphans:
+            if self.graph.has_flag(index, FLAG_MASTERY) and not self.graph.is_mastery_active(index, active):
+                active[index] = False
+                dropped.append(index)
+
+        return dropped
+
+    def commit_allocation(self, transaction: AllocationTransaction) -> Dict[int, bool]:
+        changes = self.plan_allocation(transaction)
+        for index, active in changes.items():
+            self.set_allocated(index, active)
+        self.history.commit()
+
+        return changes
+
+    def find_shortest_path(self, end: int) -> List[int]:
+        # [end, ..., allocated node], empty if end can't be reached
+        return self.path_forest.path_to(end, self.allocated, self.graph.get_ascendancy_index(self.ascendancy), self.allocation_version)
+
+    def set_stat_weights(self, weights: Dict[str, float]) -> None:
+        # stat name -> value per point of it, see stat_text.get_stat_benefit. no weights means
+        # best paths are just the shortest ones
+        self.weighted_path.set_weights(weights)
+
+    def find_best_path(self, end: int) -> List[int]:
+        # the shortest path to end with the most weighted stats, [end, ..., allocated node]
+        if not self.weighted_path.weights:
+            return self.find_shortest_path(end)
+
+        return self.weighted_path.path_to(end, self.allocated, self.graph.get_ascendancy_index(self.ascendancy))
+
+    def plan_targets(self, targets: Iterable[int]) -> List[int]:
+        # the fewest nodes that allocate all of targets at once, sharing the paths between
+        # them, see SteinerPlanner. raises ValueError if a target can't be connected
+        targets = [index for index in targets if not self.graph.has_flag(index, FLAG_ROOT)]
+        return self.planner.plan(targets, self.allocated, self.graph.get_ascendancy_index(self.ascendancy))
+
+    def is_mastery_active(self, index: int) -> bool:
+        return self.graph.is_mastery_active(index, self.allocated)
+
+    def snapshot(self) -> bytes:
+        # the allocation as a bitset, to compare builds or restore one later
+        return bytes(sum(self.allocated[i + bit] << bit for bit in range(min(8, len(self.allocated) - i)))
+                     for i in range(0, len(self.allocated), 8))
+
+    def diff_snapshot(self, snapshot: bytes) -> List[int]:
+        # the nodes that have to flip to get from the current allocation to the snapshot
+        return [i for i in range(len(self.allocated)) if (snapshot[i >> 3] >> (i & 7)) & 1 != self.allocated[i]]
+
+    def compute_stat_totals(self, snapshot: Optional[bytes] = None) -> array:
+        # stat totals from scratch for a snapshot, or the current allocation if none is given.
+        # the current mastery selections apply to both
+        if snapshot is None:
+            active = self.allocated
+        else:
+            active = bytearray((snapshot[i >> 3] >> (i & 7)) & 1 for i in range(len(self.allocated)))
+
+        return self.tree.stat_table.compute_totals(active, self.mastery_effects)
+
+    def evaluate(self, node_ids: Iterable[str], class_index: Optional[int] = None, ascendancy: Optional[str] = None) -> dict:
+        # checks a whole build without going through transactions: unknown ids, exclusive
+        # multiple choice options picked together, nodes not connected to the class start and
+        # how many more nodes each of those needs to be connected. replaces the current allocation
+        graph = self.graph
+        node_ids = list(node_ids)
+
+        unknown = [node_id for node_id in node_ids if node_id not in graph.index]
+        indices = [graph.index_of(node_id) for node_id in node_ids if node_id in graph.index]
+
+        if class_index is None:
+            # the class start is usually part of the list
+            class_index = next((self.index.class_starts.index(index) for index in indices if index in self.index.roots), 0)
+
+        self.reset(class_index, ascendancy)
+        for index in indices:
+            self.set_allocated(index, True)
+
+        conflicts = []
+        seen = set()
+        for index in indices:
+            options = self.index.choice_options.get(index)
+            if options is not None and id(options) not in seen:
+                seen.add(id(options))
+                picked = [graph.id_of(option) for option in options if self.allocated[option]]
+                if len(picked) > 1:
+                    conflicts.append(picked)
+
+        connected = bytearray(self.allocated)
+        orphans = self.drop_orphans(self.reachability.find_orphans(self.get_class_root(), connected), connected)
+
+        # cost of connecting each orphan on its own to the connected part of the build
+        ascendancy_index = graph.get_ascendancy_index(ascendancy)
+        path_costs = {}
+        for index in orphans:
+            path = self.orphan_forest.path_to(index, connected, ascendancy_index, self.allocation_version)
+            path_costs[graph.id_of(index)] = len(path) - 1 if len(path) else None
+
+        stats = self.stats
+        return {
+            'valid': not unknown and not conflicts and not orphans,
+            'class': class_index,
+            'ascendancy': ascendancy,
+            'unknown': unknown,
+            'conflicts': conflicts,
+            'orphans': [graph.id_of(index) for index in orphans],
+            'path_costs': path_costs,
+            'points': stats.points,
+            'main_points': stats.main_points,
+            'ascendancy_points': stats.ascendancy_points,
+            'notables': stats.notables,
+            'keystones': stats.keystones,
+            'masteries': stats.masteries,
+            'jewel_sockets': stats.jewel_sockets,
+        }
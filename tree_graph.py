@@ -0,0 +1,181 @@
+from array import array
+from collections import deque
+from typing import Callable, List, Optional
+
+FLAG_MASTERY = 1
+FLAG_ASCENDANCY = 2
+FLAG_ROOT = 4
+FLAG_MULTIPLE_CHOICE = 8
+FLAG_MULTIPLE_CHOICE_OPTION = 16
+FLAG_ASCENDANCY_START = 32
+FLAG_NOTABLE = 64
+FLAG_KEYSTONE = 128
+FLAG_JEWEL_SOCKET = 256
+
+_UNVISITED = -1
+
+class TreeGraph:
+    # node ids are mapped to dense indices, neighbours (out + in) are stored in CSR form:
+    # the neighbours of node i are neighbors[offsets[i]:offsets[i + 1]]
+    def __init__(self, data: dict):
+        nodes = data['nodes']
+        root_nodes = set(nodes['root']['out']) if 'root' in nodes else set()
+
+        self.ids = [node_id for node_id in nodes if node_id != 'root']
+        self.index = {node_id: i for i, node_id in enumerate(self.ids)}
+
+        self.ascendancies = []
+        ascendancy_index = {}
+
+        self.flags = array('H', [0]) * len(self.ids)
+        self.node_ascendancy = array('b', [-1]) * len(self.ids)
+        self.offsets = array('i', [0])
+        self.neighbors = array('i')
+
+        for i, node_id in enumerate(self.ids):
+            node = nodes[node_id]
+
+            flags = 0
+            if node.get('isMastery', False):
+                flags |= FLAG_MASTERY
+            if node_id in root_nodes:
+                flags |= FLAG_ROOT
+            if node.get('isMultipleChoice', False):
+                flags |= FLAG_MULTIPLE_CHOICE
+            if node.get('isMultipleChoiceOption', False):
+                flags |= FLAG_MULTIPLE_CHOICE_OPTION
+            if node.get('isAscendancyStart', False):
+                flags |= FLAG_ASCENDANCY_START
+            if node.get('isNotable', False):
+                flags |= FLAG_NOTABLE
+            if node.get('isKeystone', False):
+                flags |= FLAG_KEYSTONE
+            if node.get('isJewelSocket', False):
+                flags |= FLAG_JEWEL_SOCKET
+            if 'ascendancyName' in node:
+                flags |= FLAG_ASCENDANCY
+                name = node['ascendancyName']
+                if name not in ascendancy_index:
+                    ascendancy_index[name] = len(self.ascendancies)
+                    self.ascendancies.append(name)
+                self.node_ascendancy[i] = ascendancy_index[name]
+            self.flags[i] = flags
+
+            seen = set()
+            for neighbor in node.get('out', []) + node.get('in', []):
+                # nodes that only exist outside the tree (e.g. 'root') have no index
+                if neighbor in seen or neighbor not in self.index:
+                    continue
+                seen.add(neighbor)
+                self.neighbors.append(self.index[neighbor])
+            self.offsets.append(len(self.neighbors))
+
+        self.ascendancy_index = ascendancy_index
+
+    @classmethod
+    def from_arrays(cls, ids: List[str], flags, node_ascendancy, ascendancies: List[str], offsets, neighbors) -> 'TreeGraph':
+        # build a graph over prebuilt (e.g. memory mapped) arrays, see tree_cache
+        graph = cls.__new__(cls)
+        graph.ids = ids
+        graph.index = {node_id: i for i, node_id in enumerate(ids)}
+        graph.ascendancies = ascendancies
+        graph.ascendancy_index = {name: i for i, name in enumerate(ascendancies)}
+        graph.flags = flags
+        graph.node_ascendancy = node_ascendancy
+        graph.offsets = offsets
+        graph.neighbors = neighbors
+
+        return graph
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def index_of(self, node_id: str) -> int:
+        return self.index[node_id]
+
+    def id_of(self, index: int) -> str:
+        return self.ids[index]
+
+    def neighbors_of(self, index: int) -> array:
+        return self.neighbors[self.offsets[index]:self.offsets[index + 1]]
+
+    def has_flag(self, index: int, flag: int) -> bool:
+        return self.flags[index] & flag != 0
+
+    def is_root_node(self, index: int) -> bool:
+        return self.flags[index] & FLAG_ROOT != 0
+
+    def get_ascendancy_index(self, ascendancy_name: Optional[str]) -> int:
+        return self.ascendancy_index.get(ascendancy_name, -1)
+
+    def bfs(self, start: int, active: bytearray, skip_criteria: Optional[Callable[[int], bool]] = None, end: int = -1) -> List[int]:
+        offsets = self.offsets
+        neighbors = self.neighbors
+        flags = self.flags
+
+        parent = [_UNVISITED] * len(self.ids)
+        parent[start] = start
+        q = deque([start])
+        while len(q):
+            at = q.popleft()
+            for k in range(offsets[at], offsets[at + 1]):
+                next = neighbors[k]
+                if skip_criteria is not None and skip_criteria(next):
+                    continue
+
+                is_end = next == end
+                if (not active[next] and not is_end) and next != start and flags[next] & FLAG_ROOT:
+                    continue
+
+                if is_end or (end < 0 and active[next]):
+                    path = [next, at]
+                    while at != start:
+                        at = parent[at]
+                        path.append(at)
+                    path.reverse()
+                    return path
+
+                if parent[next] == _UNVISITED:
+                    parent[next] = at
+                    q.append(next)
+
+        return []
+
+    def is_reachable(self, start: int, target: int, active: bytearray) -> bool:
+        if self.flags[target] & FLAG_ROOT:
+            return False
+
+        flags = self.flags
+
+        def skip_criteria(index: int) -> bool:
+            return flags[index] & FLAG_MASTERY or not active[index]
+
+        return len(self.bfs(start, active, skip_criteria, target)) > 0
+
+    def find_shortest_path(self, end: int, active: bytearray, ascendancy: int = -1) -> List[int]:
+        flags = self.flags
+        end_in_ascendant = self.node_ascendancy[end] != -1 and self.node_ascendancy[end] == ascendancy
+
+        def skip_criteria(index: int) -> bool:
+            in_ascendancy = flags[index] & FLAG_ASCENDANCY
+            if not end_in_ascendant and in_ascendancy:
+                return not active[index]
+
+            if end_in_ascendant and not in_ascendancy:
+                return not active[index]
+
+            return flags[index] & FLAG_MASTERY
+
+        return self.bfs(end, active, skip_criteria)
+
+    def has_unallocated_neighbors(self, index: int, active: bytearray) -> bool:
+        flags = self.flags
+        for k in range(self.offsets[index], self.offsets[index + 1]):
+            neighbor = self.neighbors[k]
+            if not active[neighbor] and not flags[neighbor] & FLAG_MASTERY:
+                return True
+
+        return False
+
+    def is_mastery_active(self, index: int, active: bytearray) -> bool:
+        return any(active[neighbor] for neighbor in self.neighbors_of(index))
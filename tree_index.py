@@ -0,0 +1,57 @@
+from typing import Dict, List
+
+from tree_graph import (FLAG_ASCENDANCY_START, FLAG_JEWEL_SOCKET, FLAG_KEYSTONE, FLAG_MASTERY, FLAG_MULTIPLE_CHOICE,
+                        FLAG_MULTIPLE_CHOICE_OPTION, FLAG_NOTABLE, FLAG_ROOT, TreeGraph)
+
+INDEXED_FLAGS = (FLAG_MASTERY, FLAG_ROOT, FLAG_MULTIPLE_CHOICE, FLAG_MULTIPLE_CHOICE_OPTION, FLAG_ASCENDANCY_START,
+                 FLAG_NOTABLE, FLAG_KEYSTONE, FLAG_JEWEL_SOCKET)
+
+class TreeIndex:
+    # lookups over the dense node indices of a compiled tree, built once when it is loaded so
+    # nothing has to scan every node or group to answer them
+    def __init__(self, graph: TreeGraph, node_group: List[int], group_count: int, data: dict):
+        n = len(graph)
+        flags = graph.flags
+
+        self.nodes_by_ascendancy: List[List[int]] = [[] for _ in graph.ascendancies]
+        self.nodes_by_group: List[List[int]] = [[] for _ in range(group_count)]
+        self.nodes_by_flag: Dict[int, List[int]] = {flag: [] for flag in INDEXED_FLAGS}
+        # ascendancy name -> its start node
+        self.ascendancy_starts: Dict[str, int] = {}
+
+        for i in range(n):
+            if graph.node_ascendancy[i] != -1:
+                self.nodes_by_ascendancy[graph.node_ascendancy[i]].append(i)
+            if node_group[i] != -1:
+                self.nodes_by_group[node_group[i]].append(i)
+            for flag in INDEXED_FLAGS:
+                if flags[i] & flag:
+                    self.nodes_by_flag[flag].append(i)
+
+        for i in self.nodes_by_flag[FLAG_ASCENDANCY_START]:
+            self.ascendancy_starts[graph.ascendancies[graph.node_ascendancy[i]]] = i
+
+        self.roots = frozenset(self.nodes_by_flag[FLAG_ROOT])
+
+        # class index -> its start node
+        self.class_starts = [-1] * len(data['classes'])
+        for i in self.roots:
+            self.class_starts[data['nodes'][graph.id_of(i)]['classStartIndex']] = i
+
+        # masteries light up once any of their neighbours is allocated
+        self.mastery_notables: Dict[int, List[int]] = {}
+        self.node_masteries: Dict[int, List[int]] = {}
+        for mastery in self.nodes_by_flag[FLAG_MASTERY]:
+            self.mastery_notables[mastery] = [i for i in graph.neighbors_of(mastery) if flags[i] & FLAG_NOTABLE]
+            for i in graph.neighbors_of(mastery):
+                self.node_masteries.setdefault(i, []).append(mastery)
+
+        # multiple choice option -> every option of the same choice, itself included
+        choices: Dict[str, List[int]] = {}
+        for option in self.nodes_by_flag[FLAG_MULTIPLE_CHOICE_OPTION]:
+            choices.setdefault(data['nodes'][graph.id_of(option)]['in'][0], []).append(option)
+
+        self.choice_options: Dict[int, List[int]] = {}
+        for options in choices.values():
+            for option in options:
+                self.choice_options[option] = options
@@ -0,0 +1,113 @@
+from array import array
+from heapq import heappop, heappush
+from math import hypot
+from typing import Dict, List
+
+from path_forest import get_path_rules
+from stat_text import get_stat_benefit
+from tree_cache import CompiledTree
+
+class WeightedPathfinder:
+    # A* from the allocation to a target where every node costs one point minus a small bonus
+    # for the weighted value of its stats. The bonus of a whole path stays below one point, so
+    # the path is always one of the shortest and the stats only decide between those.
+    # Positions give the heuristic: no step covers more distance than the longest connection
+    # and no node costs less than 1 - tie_break.
+    #
+    # Paths follow the same rules as ShortestPathForest, see get_path_rules.
+    def __init__(self, tree: CompiledTree):
+        self.tree = tree
+        self.graph = tree.graph
+
+        self.weights: Dict[str, float] = {}
+        self.node_costs = array('d', [1.0]) * len(self.graph)
+        # largest bonus or penalty of a node. a path of length l costs at most l * (1 + b) and
+        # one of length l + 1 at least (l + 1) * (1 - b), so b < 1 / (2l + 1) for any l keeps
+        # shorter paths cheaper
+        self.tie_break = 1.0 / (2 * len(self.graph) + 2)
+
+        positions = tree.positions
+        longest = 0.0
+        for i in range(len(self.graph)):
+            for neighbor in self.graph.neighbors_of(i):
+                # nodes without a position get no heuristic, see get_heuristic
+                length = hypot(positions[i * 2] - positions[neighbor * 2], positions[i * 2 + 1] - positions[neighbor * 2 + 1])
+                if length == length:
+                    longest = max(longest, length)
+
+        self.heuristic_scale = (1.0 - self.tie_break) / longest if longest > 0 else 0.0
+
+    def set_weights(self, weights: Dict[str, float]) -> None:
+        # benefits are scaled so the most valuable node gets the full bonus
+        self.weights = dict(weights)
+
+        nodes = self.tree.data['nodes']
+        benefits = [get_stat_benefit(nodes[self.graph.id_of(i)].get('stats', []), self.weights) if self.weights else 0.0
+                    for i in range(len(self.graph))]
+        largest = max((abs(benefit) for benefit in benefits), default=0.0)
+
+        for i, benefit in enumerate(benefits):
+            self.node_costs[i] = 1.0 - self.tie_break * benefit / largest if largest > 0 else 1.0
+
+    def get_heuristic(self, end: int) -> array:
+        # lower bound of the cost from every node to end, zero where a position is missing
+        positions = self.tree.positions
+        end_x = positions[end * 2]
+        end_y = positions[end * 2 + 1]
+        scale = self.heuristic_scale
+
+        heuristic = array('d', [0.0]) * len(self.graph)
+        if end_x == end_x:
+            for i in range(len(self.graph)):
+                distance = hypot(positions[i * 2] - end_x, positions[i * 2 + 1] - end_y)
+                if distance == distance:
+                    heuristic[i] = distance * scale
+
+        return heuristic
+
+    def path_to(self, end: int, active: bytearray, ascendancy: int) -> List[int]:
+        # returns [end, ..., allocated node] like TreeGraph.find_shortest_path, empty if end
+        # can't be reached
+        graph = self.graph
+        offsets = graph.offsets
+        neighbors = graph.neighbors
+        costs = self.node_costs
+
+        end_in_ascendant = graph.node_ascendancy[end] != -1 and graph.node_ascendancy[end] == ascendancy
+        is_passable, is_source = get_path_rules(graph.flags, end_in_ascendant)
+        heuristic = self.get_heuristic(end)
+
+        # nodes may be reopened, the heuristic is only consistent where every node has a position
+        cost: Dict[int, float] = {}
+        parent: Dict[int, int] = {}
+        heap = []
+        for i in range(len(graph)):
+            if active[i] and is_source(i):
+                cost[i] = 0.0
+                heap.append((heuristic[i], i))
+        heap.sort()
+
+        while heap:
+            estimate, at = heappop(heap)
+            if at == end:
+                path = [end]
+                while at in parent:
+                    at = parent[at]
+                    path.append(at)
+                return path
+
+            if estimate > cost[at] + heuristic[at]:
+                continue
+
+            for k in range(offsets[at], offsets[at + 1]):
+                next = neighbors[k]
+                if next != end and (active[next] or not is_passable(next)):
+                    continue
+
+                next_cost = cost[at] + costs[next]
+                if next_cost < cost.get(next, float('inf')):
+                    cost[next] = next_cost
+                    parent[next] = at
+                    heappush(heap, (next_cost + heuristic[next], next))
+
+        return []